@@ -0,0 +1,328 @@
+import os
+import io
+import sys
+import json
+import lzma
+import time
+import shutil
+import random
+import struct
+import binascii
+import argparse
+import tempfile
+import statistics
+import contextlib
+from image_io import FLASH_SIZE
+from uboot_env import serialize
+
+# 性能基准：现场生成"像真的一样"的 8MB 合成固件 (不需要任何厂商镜像，不联网)，
+# 对几个入口函数计时，按 MB/s 和保存的基线比较。
+#
+# 基线和机器相关，仓库里不带：先在要做回归检查的机器上 (修改前的代码)
+#   python bench.py --save-baseline            # 写出 bench_baseline.json
+# 之后每次
+#   python bench.py --baseline bench_baseline.json
+# 比基线慢超过 --tolerance 时返回 1。显式给了 --baseline 但文件不存在时直接报错，
+# 不会悄悄跳过比较。
+BASELINE_FILE = 'bench_baseline.json'
+
+# 合成镜像里 U-Boot 的加载基址 (LDR 文字池里的指针 = 文件偏移 + 这个值)
+SYNTH_BASE = 0x4000000
+SYNTH_CODE_END = 0xA0000
+SYNTH_POOL = 0x9F000
+SYNTH_STRINGS = 0xA0000
+ANCHOR = b'SF: Detected %s with page size %u, erase size %u, total %s\n'
+
+
+def _filler_word(r):
+    # 常见 A64 指令编码 + 随机寄存器/立即数，统计特征接近真实代码
+    rd, rn, rm = r.randrange(31), r.randrange(31), r.randrange(31)
+    imm12 = r.randrange(0x1000)
+    return r.choice((
+        0xD503201F,                                          # NOP
+        0xD65F03C0,                                          # RET
+        0x91000000 | imm12 << 10 | rn << 5 | rd,             # ADD Xd, Xn, #imm
+        0xD1000000 | imm12 << 10 | rn << 5 | rd,             # SUB Xd, Xn, #imm
+        0xF100001F | imm12 << 10 | rn << 5,                  # CMP Xn, #imm
+        0xAA0003E0 | rm << 16 | rd,                          # MOV Xd, Xm
+        0xF9400000 | (imm12 & 0x1FF) << 10 | rn << 5 | rd,   # LDR Xt, [Xn, #imm]
+        0xF9000000 | (imm12 & 0x1FF) << 10 | rn << 5 | rd,   # STR Xt, [Xn, #imm]
+        0x94000000 | r.randrange(-0x8000, 0x8000) & 0x3FFFFFF,           # BL
+        0x54000000 | (r.randrange(-0x400, 0x400) & 0x7FFFF) << 5 | r.randrange(14),  # B.cond
+        0xB4000000 | (r.randrange(-0x400, 0x400) & 0x7FFFF) << 5 | rd,   # CBZ
+    ))
+
+
+def _adr(pc, target, rd):
+    imm = (target - pc) & 0x1FFFFF
+    return 0x10000000 | (imm & 3) << 29 | (imm >> 2) << 5 | rd
+
+
+def _adrp_add(pc, target, rd, base=SYNTH_BASE):
+    pages = (((target + base) >> 12) - ((pc + base) >> 12)) & 0x1FFFFF
+    adrp = 0x90000000 | (pages & 3) << 29 | (pages >> 2) << 5 | rd
+    add = 0x91000000 | ((target + base) & 0xFFF) << 10 | rd << 5 | rd
+    return adrp, add
+
+
+def _ldr_literal(pc, literal, rt):
+    return 0x58000000 | (((literal - pc) >> 2) & 0x7FFFF) << 5 | rt
+
+
+def synth_code(r, size, vocabulary=4096):
+    # 先生成一批指令，再从里面随机抽取拼成代码段，几 MB 也只要零点几秒
+    words = [_filler_word(r) for _ in range(vocabulary)]
+    return struct.pack(f'<{size // 4}I', *r.choices(words, k=size // 4))
+
+
+def synth_uboot(r, size=0xD0000):
+    """随机 A64 代码 + 字符串表 + 指针文字池，并在代码里埋几处引用 ANCHOR 的 ADR/ADRP+ADD/LDR"""
+    img = bytearray(synth_code(r, SYNTH_CODE_END))
+    img += bytes(size - len(img))
+
+    strings = [ANCHOR] + [f'synthetic message {i}: %s failed (%d)\n'.encode() for i in range(256)]
+    pos = SYNTH_STRINGS
+    str_offsets = []
+    for s in strings:
+        str_offsets.append(pos)
+        img[pos:pos + len(s) + 1] = s + b'\0'
+        pos += -(-(len(s) + 1) // 8) * 8
+    anchor = str_offsets[0]
+
+    # 文字池：字符串的运行地址，既给 LDR 用，也让加载基址推断有足够的命中
+    for i, off in enumerate(str_offsets):
+        struct.pack_into('<Q', img, SYNTH_POOL + i * 8, off + SYNTH_BASE)
+
+    # 几个"函数"里各埋一种引用
+    for site, kind in ((0x40000, 'ADR'), (0x52000, 'ADRP'), (0x61000, 'LDR'), (0x9E000, 'ADR')):
+        rd = r.randrange(31)
+        if kind == 'ADR':
+            struct.pack_into('<I', img, site, _adr(site, anchor, rd))
+        elif kind == 'ADRP':
+            struct.pack_into('<II', img, site, *_adrp_add(site, anchor, rd))
+        else:
+            struct.pack_into('<I', img, site, _ldr_literal(site, SYNTH_POOL, rd))
+    return img
+
+
+def synth_fdt(r, model=b'Synology DS120j', pad=6000):
+    """结构完整的 v17 FDT：根节点 compatible/model/填充属性 + chosen/bootargs"""
+    strings = b''
+    names = {}
+
+    def name_off(name):
+        nonlocal strings
+        if name not in names:
+            names[name] = len(strings)
+            strings += name + b'\0'
+        return names[name]
+
+    def prop(name, value):
+        blob = struct.pack('>III', 3, len(value), name_off(name)) + value
+        return blob + bytes(-len(blob) % 4)
+
+    def node(name):
+        blob = struct.pack('>I', 1) + name + b'\0'
+        return blob + bytes(-len(blob) % 4)
+
+    dt = node(b'')
+    dt += prop(b'compatible', b'marvell,armada3720\0')
+    dt += prop(b'model', model + b'\0')
+    # 属性必须在子节点之前
+    dt += prop(b'synthetic,blob', r.randbytes(pad))
+    dt += node(b'chosen') + prop(b'bootargs', b'console=ttyS0,115200\0') + struct.pack('>I', 2)
+    dt += struct.pack('>II', 2, 9)
+
+    off_rsv = 40
+    off_struct = off_rsv + 16
+    off_strings = off_struct + len(dt)
+    total = off_strings + len(strings)
+    header = struct.pack('>10I', 0xD00DFEED, total, off_struct, off_strings, off_rsv,
+                         17, 16, 0, len(strings), len(dt))
+    return header + bytes(16) + dt + strings
+
+
+def synth_uimage(payload, name, type_=3, comp=0):
+    header = bytearray(64)
+    struct.pack_into('>IIIIIIIBBBB', header, 0, 0x27051956, 0, 0, len(payload),
+                     0x2000000, 0x2000000, binascii.crc32(payload) & 0xFFFFFFFF, 5, 22, type_, comp)
+    header[32:32 + len(name)] = name
+    struct.pack_into('>I', header, 4, binascii.crc32(header) & 0xFFFFFFFF)
+    return bytes(header) + payload
+
+
+def synth_env(env_vars, size=0x1000):
+    return serialize(env_vars, size)[0]
+
+
+def synth_623(seed=1, kernel_size=0x300000, ramdisk_size=0x180000):
+    """623 风格：U-Boot / FDT@0xB0750 / ENV@0xD0000 / LZMA 内核@0xD5000 / Ramdisk@0x3DB000 / Vendor"""
+    r = random.Random(seed)
+    img = bytearray(b'\xff' * FLASH_SIZE)
+    img[:0xD0000] = synth_uboot(r)
+    fdt = synth_fdt(r)
+    img[0xB0750:0xB0750 + len(fdt)] = fdt
+    img[0xD0000:0xD1000] = synth_env({b'bootcmd': b'sf probe; sf read 0x1000000 0xD5000 0x306000',
+                                      b'ethaddr': b'00:11:32:00:00:01'})
+    kernel = lzma.compress(synth_code(r, kernel_size), format=lzma.FORMAT_ALONE, preset=1)
+    img[0xD5000:0xD5000 + len(kernel)] = kernel
+    ramdisk = synth_uimage(r.randbytes(ramdisk_size), b'ramdisk')
+    img[0x3DB000:0x3DB000 + len(ramdisk)] = ramdisk
+    img[0x7EB000:0x7EB007] = bytes.fromhex('00113200000100')
+    return bytes(img)
+
+
+def synth_new(seed=3, kernel_size=0x300000, ramdisk_size=0x200000):
+    """new.bin 风格：FDT 之后依次是 uImage 内核和 uImage Ramdisk"""
+    r = random.Random(seed)
+    img = bytearray(b'\xff' * FLASH_SIZE)
+    img[:0xD0000] = synth_uboot(r)
+    fdt = synth_fdt(r)
+    img[0xB0750:0xB0750 + len(fdt)] = fdt
+    kernel = synth_uimage(synth_code(r, kernel_size), b'kernel', type_=2)
+    img[0xD5000:0xD5000 + len(kernel)] = kernel
+    ramdisk = synth_uimage(r.randbytes(ramdisk_size), b'ramdisk')
+    off = -(-(0xD5000 + len(kernel)) // 0x10000) * 0x10000
+    img[off:off + len(ramdisk)] = ramdisk
+    return bytes(img)
+
+
+def write_fixtures(out_dir):
+    os.makedirs(out_dir, exist_ok=True)
+    for name, data in (('623.8.1.bin', synth_623(1)), ('old.bin', synth_623(2)), ('new.bin', synth_new(3))):
+        with open(os.path.join(out_dir, name), 'wb') as f:
+            f.write(data)
+
+
+# ---------------- 计时 ----------------
+
+def _bench_scan_cold():
+    from decompile_scan import scan_firmware_v2
+    shutil.rmtree('.xref_cache', ignore_errors=True)
+    scan_firmware_v2('623.8.1.bin')
+
+
+def _bench_scan_warm():
+    from decompile_scan import scan_firmware_v2
+    scan_firmware_v2('623.8.1.bin')
+
+
+def _bench_scan_cfg():
+    # 建 CFG 要把整个代码区反汇编一遍 (有缓存时直接读 npz)
+    from decompile_scan import scan_firmware_v2
+    scan_firmware_v2('623.8.1.bin', cfg=True)
+
+
+def _bench_merge():
+    from merge import merge_firmware_v3
+    merge_firmware_v3()
+
+
+def _bench_key_fix():
+    from key_fix import magic_fix_firmware
+    magic_fix_firmware()
+
+
+def _bench_verify():
+    from verify import check_firmware_health
+    check_firmware_health()
+
+
+# (名字, 函数, 处理的字节数)；verify 依赖 merge 的输出，顺序不能换
+BENCHMARKS = [
+    ('scan_firmware_v2 (cold)', _bench_scan_cold, FLASH_SIZE),
+    ('scan_firmware_v2 (warm)', _bench_scan_warm, FLASH_SIZE),
+    ('scan_firmware_v2 --cfg', _bench_scan_cfg, FLASH_SIZE),
+    ('merge_firmware_v3', _bench_merge, FLASH_SIZE),
+    ('magic_fix_firmware', _bench_key_fix, FLASH_SIZE),
+    # 只比对 U-Boot 区域：两个镜像各读 0xCC800 字节
+    ('check_firmware_health', _bench_verify, 2 * 0xCC800),
+]
+
+
+def run_benchmarks(work_dir, repeat=5, only=None):
+    """在 work_dir (已有合成镜像) 里运行各入口，返回 {名字: {'ms': 中位数, 'mbps': 吞吐}}"""
+    results = {}
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        for name, fn, nbytes in BENCHMARKS:
+            if only and not any(o in name for o in only):
+                continue
+            samples = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    fn()
+                samples.append(time.perf_counter() - start)
+            seconds = statistics.median(samples)
+            results[name] = {'ms': seconds * 1000, 'mbps': nbytes / 1048576 / seconds}
+    finally:
+        os.chdir(cwd)
+    return results
+
+
+def report(results, baseline=None, tolerance=0.2):
+    """打印结果表，返回比基线慢超过 tolerance 的项目"""
+    slower = []
+    print(f"{'Benchmark':<26} {'Median':>10} {'MB/s':>9} {'Baseline':>9} {'Change':>8}")
+    print("-" * 66)
+    for name, r in results.items():
+        line = f"{name:<26} {r['ms']:>8.1f}ms {r['mbps']:>9.1f}"
+        base = (baseline or {}).get(name)
+        if base:
+            change = r['mbps'] / base['mbps'] - 1
+            line += f" {base['mbps']:>9.1f} {change * 100:>+7.1f}%"
+            if change < -tolerance:
+                line += "  ❌"
+                slower.append(name)
+        print(line)
+    return slower
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='用合成的 8MB 固件对各入口做性能基准')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', action='append', help='只跑名字包含这个字符串的项目 (可重复)')
+    parser.add_argument('--baseline', help=f'基线文件 (默认 {BASELINE_FILE}；显式指定时必须存在)')
+    parser.add_argument('--save-baseline', action='store_true', help='把这次的结果存为基线')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='吞吐比基线低超过这个比例时返回失败 (默认 0.2)')
+    parser.add_argument('--fixtures', metavar='DIR', help='只生成合成镜像到 DIR，不计时')
+    args = parser.parse_args()
+
+    if args.fixtures:
+        write_fixtures(args.fixtures)
+        print(f"合成镜像已写入 {args.fixtures}/")
+        sys.exit(0)
+
+    baseline_path = args.baseline or BASELINE_FILE
+    baseline = None
+    if not args.save_baseline:
+        if os.path.exists(baseline_path):
+            with open(baseline_path) as f:
+                baseline = json.load(f)
+        elif args.baseline:
+            print(f"Error: 基线文件 {args.baseline} 不存在，先用 --save-baseline 记录")
+            sys.exit(1)
+
+    with tempfile.TemporaryDirectory(prefix='catdrive-bench-') as work_dir:
+        print(">>> 正在生成合成镜像...")
+        write_fixtures(work_dir)
+        print(f">>> 每项运行 {args.repeat} 次取中位数\n")
+        results = run_benchmarks(work_dir, args.repeat, args.only)
+
+    if not results:
+        print(f"Error: 没有名字包含 {args.only} 的项目，可选: {', '.join(name for name, _, _ in BENCHMARKS)}")
+        sys.exit(1)
+    slower = report(results, baseline, args.tolerance)
+    if args.save_baseline:
+        with open(baseline_path, 'w') as f:
+            json.dump(results, f, indent=1)
+        print(f"\n基线已保存到 {baseline_path}")
+    elif baseline is None:
+        print(f"\n⚠️ 没有基线文件 {baseline_path}：本次只计时，没有做回退检查。"
+              f"\n   在参考机器上运行 python bench.py --save-baseline 记录基线")
+    if slower:
+        print(f"\n❌ 性能回退: {', '.join(slower)}")
+        sys.exit(1)
@@ -0,0 +1,197 @@
+import sys
+import argparse
+from image_io import FlashImage
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+# 按 4KB (最小擦除单位) 给整个镜像的每一块分类，一次向量化计算完成，
+# 得到紧凑的区域图：哪里是真正的空闲 (擦除态/全零)，哪里是活数据。
+BLOCK = 0x1000
+
+ERASED, ZERO, LOW_ENTROPY, CODE, DATA, HIGH_ENTROPY = range(6)
+CLASS_NAMES = ('erased', 'zero', 'low-entropy', 'code', 'data', 'compressed')
+CLASS_CHARS = '.0lcd#'
+FREE = (ERASED, ZERO)
+
+# 熵阈值 (bit/字节)：4KB 的随机数据/压缩数据约 7.95
+LOW_ENTROPY_BITS = 4.0
+HIGH_ENTROPY_BITS = 7.5
+# 代码判定：高字节落在常见 A64 指令编码里的 32 位字所占比例
+CODE_DENSITY = 0.5
+
+# 常见 A64 指令的最高字节 (ADD/SUB/CMP/MOV/LDR/STR/LDP/STP/B/BL/B.cond/CBZ/TBZ/ADR/ADRP/RET/NOP ...)
+_A64_TOP_BYTES = (
+    0x91, 0xD1, 0xF1, 0x71, 0x11, 0x51, 0x31, 0xB1,
+    0xAA, 0x2A, 0x52, 0x72, 0xD2, 0xF2, 0x12, 0x92, 0x32, 0xB2,
+    0xF9, 0xB9, 0x39, 0x79, 0xF8, 0xB8, 0x38, 0x78,
+    0xA9, 0xA8, 0x29, 0x28, 0x6D,
+    0x94, 0x97, 0x14, 0x17, 0x54,
+    0x34, 0x35, 0xB4, 0xB5, 0x36, 0x37,
+    0x10, 0x30, 0x50, 0x70, 0x90, 0xB0, 0xD0, 0xF0, 0x58, 0x18,
+    0x8B, 0xCB, 0x0B, 0x4B, 0xEB, 0x6B, 0x1A, 0x9A, 0x8A, 0x0A,
+    0xD6, 0xD5, 0x53, 0xD3, 0x13, 0x93, 0x1B, 0x9B,
+)
+
+
+def classify(data, block=BLOCK):
+    """返回每个 block 的类别数组 (uint8)，不足一块的尾部按一块算"""
+    buf = np.frombuffer(data, dtype=np.uint8)
+    n = -(-len(buf) // block)
+    if n * block != len(buf):
+        buf = np.concatenate((buf, np.full(n * block - len(buf), 0xFF, dtype=np.uint8)))
+    blocks = buf.reshape(n, block)
+
+    # 擦除态/全零按 64 位字比较，最快
+    words = blocks.view(np.uint64) if block % 8 == 0 else blocks
+    erased = (words == np.iinfo(words.dtype).max).all(axis=1)
+    zero = ~words.any(axis=1)
+
+    classes = np.full(n, DATA, dtype=np.uint8)
+    classes[zero] = ZERO
+    classes[erased] = ERASED
+
+    # 熵和指令密度只对剩下的活数据块算 (Flash 里通常一半以上是空的)
+    live = np.nonzero(~(erased | zero))[0]
+    if len(live) == 0:
+        return classes
+    data_blocks = blocks[live]
+
+    # 每块的字节直方图：一次 bincount 算完所有块
+    index = (np.arange(len(live), dtype=np.intp)[:, None] << 8) | data_blocks
+    hist = np.bincount(index.ravel(), minlength=len(live) * 256).reshape(len(live), 256)
+    p = hist / block
+    with np.errstate(divide='ignore', invalid='ignore'):
+        entropy = -np.nansum(p * np.log2(p), axis=1)
+
+    # 小端 32 位字的最高字节就是每 4 字节的第 4 个
+    table = np.zeros(256, dtype=bool)
+    table[list(_A64_TOP_BYTES)] = True
+    density = np.count_nonzero(table[data_blocks[:, 3::4]], axis=1) / (block // 4)
+
+    live_classes = np.full(len(live), DATA, dtype=np.uint8)
+    live_classes[entropy >= HIGH_ENTROPY_BITS] = HIGH_ENTROPY
+    live_classes[entropy < LOW_ENTROPY_BITS] = LOW_ENTROPY
+    live_classes[(density >= CODE_DENSITY) & (entropy >= LOW_ENTROPY_BITS)] = CODE
+    classes[live] = live_classes
+    return classes
+
+
+def region_map(classes, block=BLOCK):
+    """相邻同类的块合并成 [(起始偏移, 长度, 类别)]"""
+    if len(classes) == 0:
+        return []
+    edges = np.nonzero(np.diff(classes))[0] + 1
+    starts = np.concatenate(([0], edges))
+    ends = np.concatenate((edges, [len(classes)]))
+    return [(int(s) * block, int(e - s) * block, int(classes[s])) for s, e in zip(starts, ends)]
+
+
+def find_free(classes, length, block=BLOCK, start=0, align=BLOCK, free=FREE):
+    """从 start 起第一段能放下 length 字节的空闲区域 (按 align 对齐)，没有则返回 None"""
+    need = -(-length // block)
+    is_free = np.isin(classes, free)
+    # run[i] = 从第 i 块往后连续空闲的块数 = 下一个非空闲块的位置 - i
+    busy = np.nonzero(~is_free)[0]
+    idx = np.arange(len(classes))
+    nxt = np.concatenate((busy, [len(classes)]))[np.searchsorted(busy, idx)]
+    run = nxt - idx
+    step = max(1, align // block)
+    first = -(-start // block)
+    first = -(-first // step) * step
+    hits = np.nonzero(run[first:len(classes):step] >= need)[0]
+    if len(hits) == 0:
+        return None
+    return (first + int(hits[0]) * step) * block
+
+
+def live_overlaps(classes, offset, length, block=BLOCK, free=FREE):
+    """[offset, offset+length) 覆盖到的非空闲块，合并成 [(起始, 长度, 类别)]"""
+    lo, hi = offset // block, min(len(classes), -(-(offset + length) // block))
+    hits = []
+    for start, size, cls in region_map(classes[lo:hi], block):
+        if cls not in free:
+            hits.append((start + lo * block, size, cls))
+    return hits
+
+
+def warn_overwrites(data, writes, block=BLOCK, expect=()):
+    """writes = [(偏移, 长度, 名字)]；写入会盖住活数据时打印警告，返回是否有警告。
+
+    只给写入覆盖到的块分类，不扫整个镜像。expect 是调用方本来就要替换掉的
+    类别 (比如旧 ENV 的文本)，这些不报，只报意料之外的 (代码、压缩数据等)。
+    没有 numpy 时跳过。
+    """
+    if not HAS_NUMPY:
+        return False
+    allowed = FREE + tuple(expect)
+    mv = memoryview(data)
+    warned = False
+    for offset, length, name in writes:
+        lo = offset // block * block
+        hi = min(len(mv), -(-(offset + length) // block) * block)
+        classes = classify(mv[lo:hi], block)
+        for start, size, cls in live_overlaps(classes, offset - lo, length, block, allowed):
+            print(f"  [覆盖警告] {name} 写入 {hex(offset)}+{hex(length)} 会盖住 "
+                  f"{hex(lo + start)}-{hex(lo + start + size)} 的 {CLASS_NAMES[cls]} 数据")
+            warned = True
+    return warned
+
+
+def print_map(classes, block=BLOCK, per_line=64):
+    """一块一个字符的总览，每行 per_line 块"""
+    print(f"图例: " + '  '.join(f"{c}={n}" for c, n in zip(CLASS_CHARS, CLASS_NAMES)))
+    chars = np.frombuffer(CLASS_CHARS.encode('ascii'), dtype=np.uint8)[classes].tobytes().decode('ascii')
+    for i in range(0, len(chars), per_line):
+        print(f"{i * block:#08x}  {chars[i:i + per_line]}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='按 4KB 块给镜像分类，输出区域图/空闲空间/覆盖警告')
+    parser.add_argument('image')
+    parser.add_argument('--block', type=lambda v: int(v, 0), default=BLOCK)
+    parser.add_argument('--regions', action='store_true', help='同时列出合并后的区域表')
+    parser.add_argument('--find-free', type=lambda v: int(v, 0), metavar='LENGTH',
+                        help='找一段能放下 LENGTH 字节的空闲区')
+    parser.add_argument('--start', type=lambda v: int(v, 0), default=0, help='--find-free 从这里开始找')
+    parser.add_argument('--align', type=lambda v: int(v, 0), default=BLOCK)
+    parser.add_argument('--write', action='append', default=[], metavar='OFFSET:LENGTH[:NAME]',
+                        help='检查这次写入会不会盖住活数据 (可重复)')
+    parser.add_argument('--expect', action='append', default=[], choices=CLASS_NAMES,
+                        help='--write 本来就要替换的数据类别，不报警告 (可重复)')
+    args = parser.parse_args()
+
+    if not HAS_NUMPY:
+        print("Error: 需要 numpy (pip install numpy)")
+        sys.exit(1)
+
+    with FlashImage.open(args.image) as image:
+        classes = classify(image.buf, args.block)
+        print(f">>> {args.image}: {len(classes)} 块 x {hex(args.block)}\n")
+        print_map(classes, args.block)
+        counts = np.bincount(classes, minlength=len(CLASS_NAMES))
+        print("\n" + ', '.join(f"{n} {c * args.block // 1024}KB" for n, c in zip(CLASS_NAMES, counts)))
+
+        if args.regions:
+            print(f"\n{'Start':<10} {'End':<10} {'Size':>8}  Class")
+            print("-" * 40)
+            for start, size, cls in region_map(classes, args.block):
+                print(f"{start:#08x}   {start + size:#08x}   {size // 1024:>6}KB  {CLASS_NAMES[cls]}")
+
+        if args.find_free:
+            where = find_free(classes, args.find_free, args.block, args.start, args.align)
+            if where is None:
+                print(f"\n❌ 找不到能放下 {hex(args.find_free)} 字节的空闲区")
+            else:
+                print(f"\n>>> {hex(args.find_free)} 字节可以放在 {hex(where)}")
+
+        writes = []
+        for item in args.write:
+            parts = item.split(':')
+            writes.append((int(parts[0], 0), int(parts[1], 0), parts[2] if len(parts) > 2 else item))
+        expect = [CLASS_NAMES.index(name) for name in args.expect]
+        if writes and not warn_overwrites(image.buf, writes, args.block, expect):
+            print("\n✅ 所有写入都落在空闲区 (或预期要替换的数据)")
@@ -0,0 +1,76 @@
+from locate import component_at
+
+# 启动时 sf read 的 Flash 位置 (和各脚本的布局一致)
+FLASH_KERNEL = 0xD5000
+FLASH_RAMDISK = 0x3DB000
+FLASH_DTB = 0xD1000
+
+# 启动时的内存布局：内核解压到 0x2000000，initrd 在 0x3000000
+KERNEL_LOAD_ADDR = 0x2000000
+INITRD_ADDR = 0x3000000
+KERNEL_RAM_WINDOW = INITRD_ADDR - KERNEL_LOAD_ADDR
+
+# 以前写死的读取长度，找不到组件头时退回这些值
+LEGACY_KERNEL_SIZE = 0x306000
+LEGACY_RAMDISK_SIZE = 0x410000
+LEGACY_DTB_SIZE = 0x4000
+
+# SPI NOR 页大小，读取长度向上取整到页
+SPI_PAGE = 0x100
+# sf read 的实测吞吐 (MB/s)，只用于估算节省的时间
+SPI_READ_MBPS = 10.0
+
+
+def round_page(n, page=SPI_PAGE):
+    return -(-n // page) * page
+
+
+def boot_sizes(data, kernel=FLASH_KERNEL, ramdisk=FLASH_RAMDISK, dtb=FLASH_DTB):
+    """从组件头算出启动时真正需要读取的长度 (已按页取整)。
+
+    内核是裸 LZMA (流式解压测出压缩长度)，Ramdisk 是 uImage (头 + ih_size)，
+    DTB 取 FDT totalsize。某个组件解析失败时，该项退回原来的固定长度。
+    """
+    sizes = {}
+    for name, offset, kinds, legacy in (
+            ('kernel', kernel, ('lzma', 'uimage'), LEGACY_KERNEL_SIZE),
+            ('ramdisk', ramdisk, ('uimage',), LEGACY_RAMDISK_SIZE),
+            ('dtb', dtb, ('fdt',), LEGACY_DTB_SIZE)):
+        comp = None
+        for kind in kinds:
+            comp = component_at(data, offset, kind)
+            if comp is not None:
+                break
+        if comp is None:
+            print(f"Warning: {hex(offset)} 处解析不到 {name} 头，读取长度沿用 {hex(legacy)}")
+            sizes[name] = legacy
+        else:
+            sizes[name] = round_page(comp.length)
+    return sizes
+
+
+def legacy_sizes():
+    return {'kernel': LEGACY_KERNEL_SIZE, 'ramdisk': LEGACY_RAMDISK_SIZE, 'dtb': LEGACY_DTB_SIZE}
+
+
+def sf_reads(sizes, kernel=FLASH_KERNEL, ramdisk=FLASH_RAMDISK, dtb=FLASH_DTB):
+    """读取内核 -> 解压 -> 读取 Ramdisk -> 读取 DTB 这一段 bootcmd；偏移要和 boot_sizes 用的一致"""
+    return (
+        'sf probe; '
+        f'sf read 0x1000000 0x{kernel:06X} {sizes["kernel"]:#x}; '   # 读取压缩内核到 RAM
+        'lzmadec 0x1000000 0x2000000; '                              # 解压内核
+        f'sf read 0x3000000 0x{ramdisk:X} {sizes["ramdisk"]:#x}; '   # 读取 Ramdisk
+        f'sf read 0x1000000 0x{dtb:X} {sizes["dtb"]:#x}; '           # 读取 DTB
+    )
+
+
+def spi_saving_ms(sizes, mbps=SPI_READ_MBPS):
+    """相比固定长度读取，每次启动少读的字节数和大约节省的毫秒数"""
+    saved = sum(legacy_sizes().values()) - sum(sizes.values())
+    return saved, saved / (mbps * 1024 * 1024) * 1000
+
+
+def report_saving(sizes):
+    saved, ms = spi_saving_ms(sizes)
+    print(f"  [Boot] 内核 {hex(sizes['kernel'])}, Ramdisk {hex(sizes['ramdisk'])}, DTB {hex(sizes['dtb'])}; "
+          f"每次启动少读 {saved} 字节, 约 {ms:.0f}ms (按 {SPI_READ_MBPS:g}MB/s)")
@@ -0,0 +1,165 @@
+import os
+import sys
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from image_io import FlashImage
+from locate import locate_components
+from decompile_scan import HAS_NUMPY, XREF_CACHE_DIR, XrefIndex, anchor_range, _find_refs_slow
+
+# 多版本固件库：一个目录里的所有镜像并行扫描 (组件位置 + 锚点引用)，
+# 汇总成一张表，并列出相邻版本之间哪些偏移/长度/引用点变了。
+DEFAULT_ANCHORS = ['SF: Detected']
+SUMMARY_VERSION = 1
+
+
+def _summary_path(cache_dir, sha256, anchors):
+    tag = hashlib.sha1('\0'.join(anchors).encode('utf-8')).hexdigest()[:8]
+    return os.path.join(cache_dir, f'{sha256}.{tag}.summary.json')
+
+
+def summarize_image(path, anchors=DEFAULT_ANCHORS, cache_dir=XREF_CACHE_DIR):
+    """单个镜像的摘要：组件表 + 每个锚点字符串的位置和引用点。按 sha256 缓存"""
+    with FlashImage.open(path) as image:
+        sha256 = hashlib.sha256(image.buf).hexdigest()
+        cache = _summary_path(cache_dir, sha256, anchors)
+        if os.path.exists(cache):
+            with open(cache) as f:
+                summary = json.load(f)
+            if summary.get('version') == SUMMARY_VERSION:
+                summary['name'] = os.path.basename(path)
+                return summary
+
+        code = bytes(image.buf)
+        components = [{'kind': c.kind, 'offset': c.offset, 'length': c.length}
+                      for c in locate_components(image.buf)]
+
+    index = XrefIndex.load_or_build(code, cache_dir) if HAS_NUMPY else None
+    found = {}
+    for anchor in anchors:
+        pos = code.find(anchor.encode('utf-8'))
+        if pos == -1:
+            found[anchor] = {'offset': None, 'refs': []}
+            continue
+        refs = index.refs_to(*anchor_range(pos)) if index else _find_refs_slow(code, [anchor_range(pos)])
+        found[anchor] = {'offset': pos, 'refs': [[addr, kind] for addr, kind, _ in refs]}
+
+    summary = {'version': SUMMARY_VERSION, 'name': os.path.basename(path), 'size': len(code),
+               'sha256': sha256, 'base': index.base if index else None,
+               'components': components, 'anchors': found}
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(cache, 'w') as f:
+        json.dump(summary, f)
+    return summary
+
+
+def _summarize_job(job):
+    path, anchors, cache_dir = job
+    try:
+        return summarize_image(path, anchors, cache_dir)
+    except (OSError, ValueError) as e:
+        return {'name': os.path.basename(path), 'error': str(e)}
+
+
+def scan_corpus(paths, anchors=DEFAULT_ANCHORS, cache_dir=XREF_CACHE_DIR, workers=None):
+    """并行扫描所有镜像，按输入顺序返回摘要列表"""
+    jobs = [(path, anchors, cache_dir) for path in paths]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_summarize_job, jobs))
+
+
+def features(summary):
+    """把摘要拍平成 {特征名: 值}，用来逐项比较两个版本"""
+    feats = {'size': hex(summary['size'])}
+    if summary.get('base') is not None:
+        feats['load base'] = hex(summary['base'])
+    seen = {}
+    for c in summary['components']:
+        i = seen.get(c['kind'], 0)
+        seen[c['kind']] = i + 1
+        feats[f"{c['kind']}#{i}"] = f"{c['offset']:#x} +{c['length']:#x}"
+    for anchor, a in summary['anchors'].items():
+        feats[f'"{anchor}"'] = hex(a['offset']) if a['offset'] is not None else '-'
+        feats[f'"{anchor}" refs'] = ' '.join(f'{kind}@{addr:#x}' for addr, kind in a['refs']) or '-'
+    return feats
+
+
+def diff_summaries(old, new):
+    """[(特征名, 旧值, 新值)]，只列出有变化的项"""
+    a, b = features(old), features(new)
+    keys = list(a) + [k for k in b if k not in a]
+    return [(k, a.get(k, '-'), b.get(k, '-')) for k in keys if a.get(k) != b.get(k)]
+
+
+def _print_diff(old, new):
+    changes = diff_summaries(old, new)
+    print(f"\n=== {old['name']} -> {new['name']} ({len(changes)} 项变化) ===")
+    for key, before, after in changes:
+        print(f"  {key:<28} {before:<24} -> {after}")
+
+
+def print_report(summaries):
+    ok = [s for s in summaries if 'error' not in s]
+    print(f"{'Image':<20} {'SHA256':<14} {'Comps':>5} {'FDT':<22} {'ENV':<18} Anchor refs")
+    print("-" * 96)
+    for s in summaries:
+        if 'error' in s:
+            print(f"{s['name']:<20} ❌ {s['error']}")
+            continue
+        f = features(s)
+        env = next((c for c in s['components'] if c['kind'] == 'env'), None)
+        env = f"{env['offset']:#x} +{env['length']:#x}" if env else '-'
+        refs = sum(len(a['refs']) for a in s['anchors'].values())
+        print(f"{s['name']:<20} {s['sha256'][:12]:<14} {len(s['components']):>5} "
+              f"{f.get('fdt#0', '-'):<22} {env:<18} {refs}")
+    for old, new in zip(ok, ok[1:]):
+        _print_diff(old, new)
+
+
+def list_images(directory, suffixes=('.bin', '.img')):
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.lower().endswith(suffixes) and os.path.isfile(os.path.join(directory, name)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='扫描一个目录里的所有固件版本，比较组件和引用点的变化')
+    parser.add_argument('corpus', help='放固件镜像 (*.bin / *.img) 的目录')
+    parser.add_argument('--anchor', action='append', help=f'锚点字符串 (可重复，默认 {DEFAULT_ANCHORS})')
+    parser.add_argument('--against', metavar='IMAGE', help='新到的镜像：和库里每个版本比较')
+    parser.add_argument('--json', metavar='FILE', help='同时把摘要和差异写成 JSON')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    anchors = args.anchor or DEFAULT_ANCHORS
+    paths = list_images(args.corpus)
+    if args.against:
+        paths.append(args.against)
+    if not paths:
+        print(f"Error: {args.corpus} 里没有固件镜像")
+        sys.exit(1)
+
+    summaries = scan_corpus(paths, anchors, workers=args.workers)
+    if args.against:
+        new = summaries.pop()
+        if 'error' in new:
+            print(f"Error: {args.against}: {new['error']}")
+            sys.exit(1)
+        ranked = sorted((len(diff_summaries(s, new)), s['name'], s)
+                        for s in summaries if 'error' not in s)
+        print(f"{'Corpus image':<20} Changes vs {new['name']}")
+        print("-" * 44)
+        for count, name, _ in ranked:
+            print(f"{name:<20} {count}")
+        if ranked:
+            _print_diff(ranked[0][2], new)
+        diffs = {name: diff_summaries(s, new) for _, name, s in ranked}
+        summaries.append(new)
+    else:
+        print_report(summaries)
+        ok = [s for s in summaries if 'error' not in s]
+        diffs = {f"{a['name']} -> {b['name']}": diff_summaries(a, b) for a, b in zip(ok, ok[1:])}
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'summaries': summaries, 'diffs': diffs}, f, indent=1)
@@ -0,0 +1,76 @@
+import binascii
+from functools import lru_cache
+
+# CRC-32 (反射多项式)，和 binascii.crc32 / U-Boot 的 env CRC 完全一致
+_POLY = 0xEDB88320
+
+
+def _multmodp(a, b):
+    # GF(2) 上 a * b mod P (zlib crc32_combine 的做法)
+    m = 1 << 31
+    p = 0
+    while True:
+        if a & m:
+            p ^= b
+            if (a & (m - 1)) == 0:
+                break
+        m >>= 1
+        b = (b >> 1) ^ _POLY if b & 1 else b >> 1
+    return p
+
+
+# _X2N[k] = x^(2^k) mod P
+_X2N = [1 << 30]
+for _ in range(31):
+    _X2N.append(_multmodp(_X2N[-1], _X2N[-1]))
+
+
+@lru_cache(maxsize=256)
+def _shift_op(length):
+    # x^(8 * length) mod P：把 CRC "向后推" length 个字节的算子
+    p = 1 << 31
+    n, k = length, 3
+    while n:
+        if n & 1:
+            p = _multmodp(_X2N[k & 31], p)
+        n >>= 1
+        k += 1
+    return p
+
+
+@lru_cache(maxsize=16)
+def _shift_table(length):
+    # 固定长度的推移算子是 GF(2) 上的线性映射，展开成 4 张 256 项查表，
+    # 同一长度大量合并时每次只要 4 次查表 (给 zero_extender 用)
+    op = _shift_op(length)
+    tables = []
+    for k in range(4):
+        basis = [_multmodp(op, 1 << (8 * k + i)) for i in range(8)]
+        table = [0] * 256
+        for v in range(1, 256):
+            low = (v & -v).bit_length() - 1
+            table[v] = table[v & (v - 1)] ^ basis[low]
+        tables.append(table)
+    return tables
+
+
+def crc32_combine(crc1, crc2, len2):
+    """已知 crc(A)、crc(B) 和 len(B)，直接算出 crc(A + B)，不用再扫 A"""
+    return _multmodp(_shift_op(len2), crc1) ^ crc2
+
+
+@lru_cache(maxsize=64)
+def crc32_zeros(length):
+    """length 个 0x00 的 CRC (填充区)"""
+    return binascii.crc32(bytes(length))
+
+
+def zero_extender(length):
+    """返回函数 crc(A) -> crc(A + length 个 0x00)；同一长度大量调用时每次只要 4 次查表"""
+    t0, t1, t2, t3 = _shift_table(length)
+    zeros = crc32_zeros(length)
+
+    def extend(c):
+        return t0[c & 0xFF] ^ t1[(c >> 8) & 0xFF] ^ t2[(c >> 16) & 0xFF] ^ t3[c >> 24] ^ zeros
+    return extend
+
@@ -1,80 +1,221 @@
-import struct
-import binascii
 import os
+import re
+import csv
+import time
+import argparse
+import instrument
+from concurrent.futures import ProcessPoolExecutor
+from image_io import FlashImage
+from bootcmd import boot_sizes, legacy_sizes, sf_reads, report_saving
+from validate import validate_boot_image
+from delta import DeltaTemplate, emit_delta
+from uboot_env import EnvTemplate, serialize
 
-def create_perfect_firmware_v8():
+# 核心逻辑：4KB 标准模式 (这是唯一符合物理定律的解)
+ENV_OFFSET = 0xD0000
+ENV_CALC_SIZE = 0x1000  # 4KB
+
+# 身份信息 (Vendor) 区：MAC + 校验 + "SN=...,CHK=..." 字符串
+VENDOR_OFFSET = 0x7EB000
+VENDOR_STR_OFFSET = 0x20
+VENDOR_SIZE = VENDOR_STR_OFFSET + 128
+
+BOOTARGS = 'console=ttyS0,115200 ip=off initrd=0x3000000 root=/dev/sda1 rw syno_usb_vbus_gpio=36@d0058000.usb3@1@0,37@d005e000.usb@1@0 syno_castrated_xhc=d0058000.usb3@1 swiotlb=2048 syno_hw_version=DS120j syno_fw_version=M.301 syno_hdd_powerup_seq=1 ihd_num=1 netif_num=1 syno_hdd_enable=40 syno_hdd_act_led=10 flash_size=8'
+
+
+def patch_vendor(vendor, mac_str, sn_str):
+    """在 Vendor 区 (从 0x7EB000 开始的缓冲) 里写入 MAC 和 SN"""
+    mac_bytes = bytes.fromhex(mac_str.replace(':', ''))
+    vendor[0:6] = mac_bytes
+    vendor[6] = sum(mac_bytes) & 0xFF
+
+    chk_sum = sum(ord(c) for c in sn_str)
+    vendor_str = f"SN={sn_str},CHK={chk_sum}"
+    vendor[VENDOR_STR_OFFSET : VENDOR_STR_OFFSET + 128] = b'\x00' * 128
+    vendor[VENDOR_STR_OFFSET : VENDOR_STR_OFFSET + len(vendor_str)] = vendor_str.encode('ascii')
+
+
+def build_env_vars(mac_str, sizes=None, offsets=None):
+    """4KB ENV 里的变量；sizes 为各组件的 sf read 长度，offsets 为 (kernel, ramdisk, dtb) 的 Flash 位置"""
+    boot_cmd_str = (
+        sf_reads(sizes or legacy_sizes(), *(offsets or ())) +
+        'booti 0x2000000 0x3000000 0x1000000'
+    )
+
+    return {
+        'bootcmd': boot_cmd_str,
+        'bootargs': BOOTARGS,
+        'ethaddr': mac_str,
+        'bootdelay': '3' # V8 签名认证
+    }
+
+
+def build_env(mac_str, sizes=None):
+    """生成带 CRC 的 4KB 环境变量块，返回 (块, crc)"""
+    return serialize(build_env_vars(mac_str, sizes), ENV_CALC_SIZE)
+
+
+def create_perfect_firmware_v8(delta=False):
     # ！！！文件名已修改，防止混淆！！！
     input_file = 'hybrid_ultimate.bin'
     output_file = 'hybrid_v8_final.bin'
-    
+
     # --- 定制信息 ---
     NEW_MAC_STR = "00:11:32:A3:67:EF"
     NEW_SN_STR  = "1910Q2N321313"
-    
-    # 核心逻辑：4KB 标准模式 (这是唯一符合物理定律的解)
-    ENV_OFFSET = 0xD0000
-    ENV_CALC_SIZE = 0x1000  # 4KB
-    
+
     if not os.path.exists(input_file):
         print(f"Error: 找不到 {input_file}")
         return
 
-    with open(input_file, 'rb') as f:
-        data = bytearray(f.read())
+    # 在输出副本上原地修改，只动 Vendor 和 ENV 两块
+    with instrument.stage('load'):
+        image = FlashImage.clone(input_file, output_file)
+    data = image.buf
 
     print(f"正在生成 V8 (4KB Standard)...")
 
     # 1. 身份信息 (Vendor)
-    vendor_offset = 0x7EB000
-    mac_bytes = bytes.fromhex(NEW_MAC_STR.replace(':', ''))
-    data[vendor_offset : vendor_offset + 6] = mac_bytes
-    data[vendor_offset + 6] = sum(mac_bytes) & 0xFF
-    
-    chk_sum = sum(ord(c) for c in NEW_SN_STR)
-    vendor_str = f"SN={NEW_SN_STR},CHK={chk_sum}"
-    target_idx = vendor_offset + 0x20
-    data[target_idx : target_idx + 128] = b'\x00' * 128
-    data[target_idx : target_idx + len(vendor_str)] = vendor_str.encode('ascii')
-
-    # 2. 环境变量 (4KB Payload)
-    boot_cmd_str = (
-        'sf probe; '
-        'sf read 0x1000000 0x0D5000 0x306000; ' 
-        'lzmadec 0x1000000 0x2000000; '         
-        'sf read 0x3000000 0x3DB000 0x410000; ' 
-        'sf read 0x1000000 0xD1000 0x4000; '    
-        'booti 0x2000000 0x3000000 0x1000000'   
-    )
-    
-    env_dict = {
-        'bootcmd': boot_cmd_str,
-        'bootargs': 'console=ttyS0,115200 ip=off initrd=0x3000000 root=/dev/sda1 rw syno_usb_vbus_gpio=36@d0058000.usb3@1@0,37@d005e000.usb@1@0 syno_castrated_xhc=d0058000.usb3@1 swiotlb=2048 syno_hw_version=DS120j syno_fw_version=M.301 syno_hdd_powerup_seq=1 ihd_num=1 netif_num=1 syno_hdd_enable=40 syno_hdd_act_led=10 flash_size=8',
-        'ethaddr': NEW_MAC_STR,
-        'bootdelay': '3' # V8 签名认证
-    }
+    with instrument.stage('identity'):
+        patch_vendor(data[VENDOR_OFFSET : VENDOR_OFFSET + VENDOR_SIZE], NEW_MAC_STR, NEW_SN_STR)
+
+    # 2. 环境变量 (4KB Payload)，sf read 只读组件头里的真实长度
+    with instrument.stage('env build'):
+        sizes = boot_sizes(data)
+        report_saving(sizes)
+        final_env, crc = build_env(NEW_MAC_STR, sizes)
+        image.write(ENV_OFFSET, final_env)
 
-    # 构建 Payload
-    env_payload = bytearray()
-    for k, v in env_dict.items():
-        env_payload += k.encode('ascii') + b'=' + v.encode('ascii') + b'\0'
-    env_payload += b'\0'
-    
-    # 填充到 4KB - 4
-    env_block = env_payload.ljust(ENV_CALC_SIZE - 4, b'\x00')
-    
-    # 计算 CRC (仅 4KB)
-    crc = binascii.crc32(env_block) & 0xFFFFFFFF
-    
-    # 写入
-    final_env = struct.pack('<I', crc) + env_block
-    data[ENV_OFFSET : ENV_OFFSET + ENV_CALC_SIZE] = final_env
-    
     print(f"  [CRC Fix] 4KB CRC: {hex(crc)}")
 
-    with open(output_file, 'wb') as f:
-        f.write(data)
-        
+    ok = validate_boot_image(data)
+    image.close()
+    if not ok:
+        os.remove(output_file)
+        print(f"\n❌ 校验失败，{output_file} 已删除！")
+        return
+
     print(f"\n成功！{output_file} 已生成。")
+    if delta:
+        emit_delta(input_file, output_file, [(ENV_OFFSET, ENV_CALC_SIZE), (VENDOR_OFFSET, VENDOR_SIZE)])
+
+
+# ---------------- 批量 (Fleet) 模式 ----------------
+
+def load_units_csv(path):
+    """CSV 每行 mac,sn (可以有表头)"""
+    units = []
+    with open(path, newline='') as f:
+        for row in csv.reader(f):
+            if len(row) < 2 or row[0].strip().lower() == 'mac':
+                continue
+            units.append((row[0].strip(), row[1].strip()))
+    return units
+
+
+def unit_range(mac_start, sn_start, count):
+    """MAC 按 48 位整数递增，SN 末尾的数字部分递增 (保持位数)"""
+    mac = int(mac_start.replace(':', ''), 16)
+    m = re.match(r'^(.*?)(\d+)$', sn_start)
+    if not m:
+        raise ValueError(f"SN 末尾没有数字，无法递增: {sn_start}")
+    prefix, digits = m.groups()
+    units = []
+    for i in range(count):
+        mac_hex = f'{mac + i:012X}'
+        mac_str = ':'.join(mac_hex[j:j + 2] for j in range(0, 12, 2))
+        units.append((mac_str, f'{prefix}{int(digits) + i:0{len(digits)}d}'))
+    return units
+
+
+# 每个工作进程只映射一次基础镜像 (页缓存在进程间共享)
+_fleet_base = None
+_fleet_vendor = None
+_fleet_delta = None
+_fleet_env = None
+
+
+def _fleet_init(base_path, sizes, as_patch):
+    global _fleet_base, _fleet_vendor, _fleet_delta, _fleet_env
+    _fleet_base = FlashImage.open(base_path)
+    _fleet_vendor = bytes(_fleet_base.view(VENDOR_OFFSET, VENDOR_SIZE))
+    if as_patch:
+        # 补丁模式：基础镜像的 sha256 和两段之外的 CRC 每个进程只算一次
+        _fleet_delta = DeltaTemplate(_fleet_base.buf, [(ENV_OFFSET, ENV_CALC_SIZE),
+                                                       (VENDOR_OFFSET, VENDOR_SIZE)])
+    # 模板只序列化一次，每台设备只拼接 ethaddr
+    _fleet_env = EnvTemplate(build_env_vars('00:00:00:00:00:00', sizes), ENV_CALC_SIZE, vary=('ethaddr',))
+
+
+def _fleet_unit(job):
+    mac_str, sn_str, out_dir, as_patch = job
+    vendor = bytearray(_fleet_vendor)
+    patch_vendor(vendor, mac_str, sn_str)
+    env, _ = _fleet_env.render(ethaddr=mac_str)
+    regions = ((ENV_OFFSET, env), (VENDOR_OFFSET, vendor))
+
+    if as_patch:
+        # delta.py 格式，用 python delta.py apply 还原成完整镜像
+        path = os.path.join(out_dir, f'{sn_str}.delta')
+        return path, _fleet_delta.write(path, [blob for _, blob in regions])
+
+    # 完整镜像：整块交给内核复制，再只改两块
+    path = os.path.join(out_dir, f'{sn_str}.bin')
+    with FlashImage.create(path, _fleet_base.size) as out:
+        out.copy_from(_fleet_base, 0, 0, _fleet_base.size)
+        fd = out.fd
+        for offset, blob in regions:
+            os.pwrite(fd, blob, offset)
+    return path, _fleet_base.size
+
+
+def create_fleet(units, base_file='hybrid_ultimate.bin', out_dir='fleet', as_patch=False, workers=None):
+    if not os.path.exists(base_file):
+        print(f"Error: 找不到 {base_file}")
+        return
+    os.makedirs(out_dir, exist_ok=True)
+
+    kind = "补丁" if as_patch else "完整镜像"
+    print(f"正在批量生成 {len(units)} 台设备的{kind} -> {out_dir}/")
+    start = time.perf_counter()
+    # 组件长度只在主进程测一次 (内核要流式解压)，再交给各工作进程
+    # 每台设备只改 ENV/Vendor，内核等组件只需在基础镜像上校验一次
+    with FlashImage.open(base_file) as base:
+        sizes = boot_sizes(base.buf)
+        if not validate_boot_image(base.buf):
+            print(f"Error: {base_file} 校验失败，停止批量生成")
+            return
+    report_saving(sizes)
+    jobs = [(mac, sn, out_dir, as_patch) for mac, sn in units]
+    total = 0
+    with instrument.stage('fleet'), \
+            ProcessPoolExecutor(max_workers=workers, initializer=_fleet_init,
+                                initargs=(base_file, sizes, as_patch)) as pool:
+        for path, size in pool.map(_fleet_unit, jobs, chunksize=32):
+            total += size
+        instrument.count(written=total)
+    elapsed = time.perf_counter() - start
+    print(f"\n成功！{len(units)} 个文件, 共 {total / 1048576:.1f} MB, "
+          f"耗时 {elapsed:.2f}s ({len(units) / elapsed:.0f} 台/秒)")
+
 
 if __name__ == "__main__":
-    create_perfect_firmware_v8()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--csv', help='批量模式：每行 mac,sn 的 CSV 文件')
+    parser.add_argument('--range', nargs=3, metavar=('MAC_START', 'SN_START', 'COUNT'),
+                        help='批量模式：从 MAC_START/SN_START 开始连续 COUNT 台')
+    parser.add_argument('--base', default='hybrid_ultimate.bin')
+    parser.add_argument('--out-dir', default='fleet')
+    parser.add_argument('--patch', action='store_true', help='每台只输出增量补丁 (.delta)，而不是完整 8MB 镜像')
+    parser.add_argument('--delta', action='store_true', help='单台模式：输出相对 hybrid_ultimate.bin 的增量补丁')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.csv or args.range:
+        if args.csv:
+            units = load_units_csv(args.csv)
+        else:
+            units = unit_range(args.range[0], args.range[1], int(args.range[2]))
+        create_fleet(units, args.base, args.out_dir, args.patch, args.workers)
+    else:
+        create_perfect_firmware_v8(args.delta)
@@ -1,5 +1,9 @@
 import sys
+import os
 import struct
+import hashlib
+import argparse
+import instrument
 
 try:
     from capstone import *
@@ -9,17 +13,529 @@ except ImportError:
     print("CRITICAL: Capstone not installed.")
     HAS_CAPSTONE = False
 
-def scan_firmware_v2():
-    filename = '623.8.1.bin'
-    
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+# ADRP 之后的 ADD 不一定紧挨着，编译器常会插入 1~3 条无关指令
+ADRP_PAIR_WINDOW = 4
+
+
+def _sign_extend(value, bits):
+    # 按位宽做符号扩展 (numpy 数组和普通 int 都适用)
+    sign = 1 << (bits - 1)
+    return (value ^ sign) - sign
+
+
+def decode_xrefs(code, base=0):
+    """一次性批量解码整个镜像里的 ADR / ADRP+ADD / LDR(literal) 引用。
+
+    返回 (addrs, targets, kinds) 三个等长数组：
+    addrs 是指令地址 (文件偏移)，targets 是引用目标 (文件偏移；LDR 为文字池里
+    加载出来的指针值减去 base)，kinds 为 0=ADR, 1=ADRP+ADD (addr 为 ADRP 的地址), 2=LDR。
+    base 是 U-Boot 的加载基址：运行地址 = 文件偏移 + base。
+    """
+    n = len(code) // 4
+    words = np.frombuffer(code, dtype='<u4', count=n).astype(np.int64)
+    pcs = np.arange(n, dtype=np.int64) * 4
+
+    # --- ADR: op=0, 10000 ---
+    is_adr = (words & 0x9F000000) == 0x10000000
+    idx = np.nonzero(is_adr)[0]
+    w = words[idx]
+    imm = (((w >> 5) & 0x7FFFF) << 2) | ((w >> 29) & 0x3)
+    adr_addrs = pcs[idx]
+    adr_targets = adr_addrs + _sign_extend(imm, 21)
+
+    # --- ADRP + ADD Xd, Xd, #imm ---
+    # ADRP 只给出 4KB 页，真正的地址要加上后面 ADD 的低 12 位
+    is_adrp = (words & 0x9F000000) == 0x90000000
+    is_add = (words & 0xFF800000) == 0x91000000
+    adrp_idx = np.nonzero(is_adrp)[0]
+    w = words[adrp_idx]
+    imm = (((w >> 5) & 0x7FFFF) << 2) | ((w >> 29) & 0x3)
+    # 页对齐按运行地址计算，再换回文件偏移
+    page = ((pcs[adrp_idx] + base) & ~0xFFF) + (_sign_extend(imm, 21) << 12) - base
+    rd = w & 0x1F
+    pair_addrs = []
+    pair_targets = []
+    paired = np.zeros(len(adrp_idx), dtype=bool)
+    for dist in range(1, ADRP_PAIR_WINDOW + 1):
+        j = adrp_idx + dist
+        ok = (j < n) & ~paired
+        j = np.where(ok, j, 0)
+        nxt = words[j]
+        ok &= is_add[j] & (((nxt >> 5) & 0x1F) == rd)
+        ok &= (nxt & 0x1F) == rd
+        imm12 = (nxt >> 10) & 0xFFF
+        imm12 = np.where((nxt >> 22) & 1, imm12 << 12, imm12)
+        pair_addrs.append(pcs[adrp_idx][ok])
+        pair_targets.append((page + imm12)[ok])
+        paired |= ok
+    adrp_addrs = np.concatenate(pair_addrs)
+    adrp_targets = np.concatenate(pair_targets)
+
+    # --- LDR Xt, label (64 位文字池) ---
+    is_ldr = (words & 0xFF000000) == 0x58000000
+    idx = np.nonzero(is_ldr)[0]
+    w = words[idx]
+    lit = pcs[idx] + _sign_extend(((w >> 5) & 0x7FFFF) << 2, 21)
+    # 与原扫描保持一致：文字池地址必须落在 [0, len - 8) 内
+    ok = (lit >= 0) & (lit < len(code) - 8)
+    lit_words = lit[ok] // 4
+    ok_idx = idx[ok]
+    lo = words[lit_words].astype(np.uint64)
+    hi = words[lit_words + 1].astype(np.uint64)
+    ldr_addrs = pcs[ok_idx]
+    # 超过 2^63 的 "指针" 不可能是有效地址，按 int64 回绕后自然匹配不上
+    ldr_targets = (lo | (hi << np.uint64(32))).view(np.int64) - base
+
+    addrs = np.concatenate([adr_addrs, adrp_addrs, ldr_addrs])
+    targets = np.concatenate([adr_targets, adrp_targets, ldr_targets])
+    kinds = np.concatenate([
+        np.zeros(len(adr_addrs), dtype=np.int8),
+        np.ones(len(adrp_addrs), dtype=np.int8),
+        np.full(len(ldr_addrs), 2, dtype=np.int8),
+    ])
+    order = np.argsort(addrs, kind='stable')
+    return addrs[order], targets[order], kinds[order]
+
+
+XREF_KINDS = ('ADR', 'ADRP', 'LDR')
+
+# 基址推断：只认落在这个对齐上的候选基址 (U-Boot TEXT_BASE 一般按页对齐)
+LOAD_BASE_ALIGN = 0x1000
+# 至少这么多个指针同时命中字符串开头，才认为推断可信
+LOAD_BASE_MIN_HITS = 8
+
+
+def infer_load_base(code, str_offsets=None, align=LOAD_BASE_ALIGN, min_hits=LOAD_BASE_MIN_HITS):
+    """推断 U-Boot 的加载基址，返回 (base, 命中数)；推断不出来时返回 (0, 0)。
+
+    思路：收集所有 8 字节对齐、看起来像指针的 64 位字面量 v，和已知字符串
+    开头 s 配对，候选基址为 v - s。只把低位 (mod align) 相同的 v/s 配对，
+    每个指针只需要和少量字符串组合，然后对所有候选直方图计数取众数。
+    """
+    if str_offsets is None:
+        str_offsets, _ = extract_strings(code)
+    if len(str_offsets) == 0:
+        return 0, 0
+    n = len(code) // 8
+    ptrs = np.frombuffer(code, dtype='<u8', count=n)
+    # 看起来像指针：非零且高 16 位为 0
+    ptrs = ptrs[(ptrs != 0) & (ptrs < (1 << 48))].astype(np.int64)
+    if len(ptrs) == 0:
+        return 0, 0
+
+    s_key = str_offsets % align
+    order = np.argsort(s_key, kind='stable')
+    s_sorted = str_offsets[order]
+    s_key = s_key[order]
+    p_key = ptrs % align
+    lo = np.searchsorted(s_key, p_key, side='left')
+    hi = np.searchsorted(s_key, p_key, side='right')
+    counts = hi - lo
+    keep = counts > 0
+    ptrs, lo, counts = ptrs[keep], lo[keep], counts[keep]
+    if len(ptrs) == 0:
+        return 0, 0
+    # 展开 (指针, 同余字符串) 对
+    rep_ptr = np.repeat(ptrs, counts)
+    starts = np.repeat(lo - np.cumsum(counts) + counts, counts)
+    s_idx = np.arange(len(rep_ptr)) + starts
+    bases = rep_ptr - s_sorted[s_idx]
+    # 指针比字符串偏移小时候选为负，不可能是基址
+    bases = bases[(bases >= 0) & (bases % align == 0)]
+    if len(bases) == 0:
+        return 0, 0
+    cand, hits = np.unique(bases, return_counts=True)
+    best = int(np.argmax(hits))
+    if hits[best] < min_hits:
+        return 0, 0
+    return int(cand[best]), int(hits[best])
+
+
+def _find_refs_slow(code, ranges):
+    # 没装 numpy 时的逐字扫描 (原 V2 逻辑，不含 ADRP 配对)
+    hits = []
+    for addr in range(0, len(code) - 3, 4):
+        insn_val = struct.unpack_from('<I', code, addr)[0]
+        if (insn_val & 0x9F000000) == 0x10000000:
+            imm = (((insn_val >> 5) & 0x7FFFF) << 2) | ((insn_val >> 29) & 0x3)
+            kind, target = 'ADR', addr + _sign_extend(imm, 21)
+        elif (insn_val & 0xFF000000) == 0x58000000:
+            lit = addr + _sign_extend(((insn_val >> 5) & 0x7FFFF) << 2, 21)
+            if not 0 <= lit < len(code) - 8:
+                continue
+            kind, target = 'LDR', struct.unpack_from('<Q', code, lit)[0]
+        else:
+            continue
+        if any(lo <= target < hi for lo, hi in ranges):
+            hits.append((addr, kind, target))
+    return hits
+
+
+def find_refs(code, ranges):
+    """返回所有指向任一 [lo, hi) 区间的引用：[(指令地址, 类型, 目标), ...]"""
+    if not HAS_NUMPY:
+        return _find_refs_slow(code, ranges)
+    addrs, targets, kinds = decode_xrefs(code)
+    mask = np.zeros(len(addrs), dtype=bool)
+    for lo, hi in ranges:
+        mask |= (targets >= lo) & (targets < hi)
+    return [(int(a), XREF_KINDS[k], int(t))
+            for a, t, k in zip(addrs[mask], targets[mask], kinds[mask])]
+
+
+def anchor_range(anchor_offset, slack=64):
+    # 允许 64 字节误差 (指向字符串中间也算)
+    return (anchor_offset - slack + 1, anchor_offset + slack)
+
+
+def extract_strings(code, min_len=4):
+    """找出镜像里所有以 NUL 结尾的可打印字符串，返回 (offsets, lengths)"""
+    b = np.frombuffer(code, dtype=np.uint8)
+    printable = ((b >= 0x20) & (b < 0x7F)) | (b == 0x09) | (b == 0x0A) | (b == 0x0D)
+    edges = np.diff(np.concatenate(([0], printable.astype(np.int8), [0])))
+    starts = np.nonzero(edges == 1)[0]
+    ends = np.nonzero(edges == -1)[0]
+    ok = (ends - starts >= min_len) & (ends < len(b))
+    ok[ok] &= b[ends[ok]] == 0
+    return starts[ok].astype(np.int64), (ends - starts)[ok].astype(np.int64)
+
+
+XREF_CACHE_DIR = os.environ.get('XREF_CACHE_DIR', '.xref_cache')
+XREF_INDEX_VERSION = 1
+# CFG 缓存的格式/切块规则版本 (改了建图逻辑就加一，旧缓存自动重建)
+CFG_CACHE_VERSION = 2
+
+
+class XrefIndex:
+    """整镜像的字符串表 + 引用表，按镜像 SHA-256 缓存到磁盘。
+
+    建一次索引之后，每个锚点只需要在按目标地址排序的数组上做二分查找，
+    不再需要从头扫描整个镜像。
+    """
+
+    def __init__(self, sha256, base, str_offsets, str_lengths, ref_addrs, ref_targets, ref_kinds):
+        self.sha256 = sha256
+        self.base = base
+        self.str_offsets = str_offsets
+        self.str_lengths = str_lengths
+        # 引用表按目标地址排序，方便 searchsorted
+        self.ref_addrs = ref_addrs
+        self.ref_targets = ref_targets
+        self.ref_kinds = ref_kinds
+        self._table = None
+
+    @classmethod
+    def build(cls, code, sha256=None, base=None):
+        """base 为 None 时自动推断加载基址"""
+        with instrument.stage('xref scan', read=len(code)):
+            return cls._build(code, sha256, base)
+
+    @classmethod
+    def _build(cls, code, sha256, base):
+        sha256 = sha256 or hashlib.sha256(code).hexdigest()
+        str_offsets, str_lengths = extract_strings(code)
+        if base is None:
+            base, _ = infer_load_base(code, str_offsets)
+        addrs, targets, kinds = decode_xrefs(code, base)
+        order = np.argsort(targets, kind='stable')
+        return cls(sha256, base, str_offsets, str_lengths,
+                   addrs[order], targets[order], kinds[order])
+
+    @classmethod
+    def load_or_build(cls, code, cache_dir=XREF_CACHE_DIR, base=None):
+        sha256 = hashlib.sha256(code).hexdigest()
+        tag = 'auto' if base is None else f'{base:x}'
+        path = os.path.join(cache_dir, f'{sha256}.{tag}.xref.npz')
+        if os.path.exists(path):
+            with np.load(path) as z:
+                if int(z['version']) == XREF_INDEX_VERSION:
+                    return cls(sha256, int(z['base']), z['str_offsets'], z['str_lengths'],
+                               z['ref_addrs'], z['ref_targets'], z['ref_kinds'])
+        index = cls.build(code, sha256, base)
+        index.save(path)
+        return index
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # 先写临时文件再替换，避免并发/中断时留下半个缓存
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, version=XREF_INDEX_VERSION, base=self.base,
+                     str_offsets=self.str_offsets, str_lengths=self.str_lengths,
+                     ref_addrs=self.ref_addrs, ref_targets=self.ref_targets,
+                     ref_kinds=self.ref_kinds)
+        os.replace(tmp, path)
+
+    def refs_to(self, lo, hi):
+        """指向 [lo, hi) 的所有引用，按指令地址排序"""
+        i = np.searchsorted(self.ref_targets, lo, side='left')
+        j = np.searchsorted(self.ref_targets, hi, side='left')
+        hits = sorted(zip(self.ref_addrs[i:j].tolist(),
+                          self.ref_kinds[i:j].tolist(),
+                          self.ref_targets[i:j].tolist()))
+        return [(a, XREF_KINDS[k], t) for a, k, t in hits]
+
+    def string_at(self, offset):
+        """包含 offset 的字符串条目 (起始偏移, 长度)，不在字符串里则返回 None"""
+        i = int(np.searchsorted(self.str_offsets, offset, side='right')) - 1
+        if i < 0 or offset >= self.str_offsets[i] + self.str_lengths[i]:
+            return None
+        return int(self.str_offsets[i]), int(self.str_lengths[i])
+
+    def _string_table(self, code):
+        # 字符串表里的所有字符串用 NUL 连成一段 (第一次查询时拼一次)，
+        # 之后查找只扫这段而不是整个镜像；字符串都是可打印字符，匹配不会跨条目
+        if self._table is None:
+            mv = memoryview(code)
+            blob = b'\0'.join(mv[o:o + n] for o, n in zip(self.str_offsets.tolist(), self.str_lengths.tolist()))
+            starts = np.concatenate(([0], np.cumsum(self.str_lengths[:-1] + 1)))
+            self._table = (blob, starts)
+        return self._table
+
+    def refs_to_string(self, code, needle, slack=64):
+        """字符串表里所有包含 needle 的位置 -> 引用列表"""
+        blob, starts = self._string_table(code)
+        result = {}
+        pos = blob.find(needle)
+        while pos != -1:
+            i = int(np.searchsorted(starts, pos, side='right')) - 1
+            offset = int(self.str_offsets[i]) + pos - int(starts[i])
+            result[offset] = self.refs_to(*anchor_range(offset, slack))
+            pos = blob.find(needle, pos + 1)
+        return result
+
+
+# U-Boot 代码区 (ENV 之前)，整段反汇编建图的默认范围
+UBOOT_CODE_END = 0xD0000
+
+# 分支类型
+BR_JUMP, BR_COND, BR_CALL, BR_RET, BR_ICALL = range(5)
+_COND_BRANCHES = ('cbz', 'cbnz', 'tbz', 'tbnz')
+
+
+def _branch_type(mnemonic):
+    if mnemonic == 'b':
+        return BR_JUMP
+    if mnemonic.startswith('b.') or mnemonic in _COND_BRANCHES:
+        return BR_COND
+    if mnemonic == 'bl':
+        return BR_CALL
+    if mnemonic in ('ret', 'br', 'eret', 'retaa', 'retab'):
+        return BR_RET
+    if mnemonic == 'blr':
+        return BR_ICALL
+    return None
+
+
+class CodeGraph:
+    """U-Boot 代码区的基本块 + 分支/调用图，全部存成紧凑数组并按镜像哈希缓存。
+
+    整段代码只用 Capstone lite 模式反汇编一次；之后 "某地址属于哪个函数"、
+    "哪些条件分支支配这条引用" 之类的问题都只在数组上查询。
+    """
+
+    FIELDS = ('br_addr', 'br_target', 'br_type', 'block_start', 'block_end',
+              'edge_src', 'edge_dst', 'func_start')
+
+    def __init__(self, sha256, code_start, code_end, **arrays):
+        self.sha256 = sha256
+        self.code_start = code_start
+        self.code_end = code_end
+        for name in self.FIELDS:
+            setattr(self, name, arrays[name])
+        self._succ = None
+
+    @classmethod
+    def build(cls, code, code_start=0, code_end=UBOOT_CODE_END, sha256=None):
+        with instrument.stage('cfg build', read=min(code_end, len(code)) - code_start):
+            return cls._build(code, code_start, code_end, sha256)
+
+    @classmethod
+    def _build(cls, code, code_start, code_end, sha256):
+        sha256 = sha256 or hashlib.sha256(code).hexdigest()
+        code_end = min(code_end, len(code))
+        md = Cs(CS_ARCH_ARM64, CS_MODE_LITTLE_ENDIAN)
+        md.detail = False
+        # 数据/非法指令不中断反汇编，当成 .byte 跳过
+        md.skipdata = True
+
+        br_addr, br_target, br_type = [], [], []
+        for addr, size, mnemonic, op_str in md.disasm_lite(code[code_start:code_end], code_start):
+            kind = _branch_type(mnemonic)
+            if kind is None:
+                continue
+            target = -1
+            if kind in (BR_JUMP, BR_COND, BR_CALL):
+                # 目标总是最后一个操作数 "#0x..."
+                last = op_str.rsplit('#', 1)[-1]
+                try:
+                    target = int(last, 16)
+                except ValueError:
+                    target = -1
+                # 跳到 0 以下时 Capstone 打印回绕的 64 位立即数 (#0xffff...fc10)，
+                # 镜像外的目标一律记成 -1
+                if not 0 <= target < len(code):
+                    target = -1
+            br_addr.append(addr)
+            br_target.append(target)
+            br_type.append(kind)
+        br_addr = np.array(br_addr, dtype=np.int64)
+        br_target = np.array(br_target, dtype=np.int64)
+        br_type = np.array(br_type, dtype=np.int8)
+
+        # 函数起点：BL 目标 + 标准序言 "stp x29, x30, [sp, #-N]!"
+        calls = br_target[(br_type == BR_CALL) & (br_target >= code_start) & (br_target < code_end)]
+        words = np.frombuffer(code, dtype='<u4', count=code_end // 4)[code_start // 4:]
+        prologues = np.nonzero((words & 0xFFC07FFF) == 0xA9807BFD)[0] * 4 + code_start
+        func_start = np.unique(np.concatenate(([code_start], calls, prologues)))
+
+        # 基本块起点：区域开头、函数起点、代码区内的跳转目标、跳转/返回之后的下一条
+        # (函数起点也要切块，否则一个块会从上一个函数一直延伸到下一个函数里)
+        inside = (br_target >= code_start) & (br_target < code_end) & (br_type != BR_CALL)
+        ends_block = (br_type != BR_CALL) & (br_type != BR_ICALL)
+        leaders = np.unique(np.concatenate((
+            [code_start], func_start, br_target[inside], br_addr[ends_block] + 4)))
+        leaders = leaders[leaders < code_end]
+        block_start = leaders
+        block_end = np.append(leaders[1:], code_end)
+
+        # 边：每个块的最后一条指令决定后继
+        last = block_end - 4
+        kinds = np.full(len(block_start), -1, dtype=np.int8)
+        targets = np.full(len(block_start), -1, dtype=np.int64)
+        if len(br_addr):
+            pos = np.minimum(np.searchsorted(br_addr, last), len(br_addr) - 1)
+            has_br = br_addr[pos] == last
+            kinds[has_br] = br_type[pos[has_br]]
+            targets[has_br] = br_target[pos[has_br]]
+        blk = np.arange(len(block_start))
+        falls = (kinds == -1) | (kinds == BR_COND) | (kinds == BR_CALL) | (kinds == BR_ICALL)
+        falls &= blk + 1 < len(block_start)
+        jumps = ((kinds == BR_JUMP) | (kinds == BR_COND)) & (targets >= code_start) & (targets < code_end)
+        edge_src = np.concatenate((blk[falls], blk[jumps]))
+        edge_dst = np.concatenate((blk[falls] + 1,
+                                   np.searchsorted(block_start, targets[jumps], side='right') - 1))
+        order = np.lexsort((edge_dst, edge_src))
+
+        return cls(sha256, code_start, code_end,
+                   br_addr=br_addr, br_target=br_target, br_type=br_type,
+                   block_start=block_start, block_end=block_end,
+                   edge_src=edge_src[order], edge_dst=edge_dst[order],
+                   func_start=func_start)
+
+    @classmethod
+    def load_or_build(cls, code, code_start=0, code_end=UBOOT_CODE_END, cache_dir=XREF_CACHE_DIR):
+        sha256 = hashlib.sha256(code).hexdigest()
+        code_end = min(code_end, len(code))
+        path = os.path.join(cache_dir, f'{sha256}.{code_start:x}-{code_end:x}.cfg.npz')
+        if os.path.exists(path):
+            with np.load(path) as z:
+                if int(z['version']) == CFG_CACHE_VERSION:
+                    return cls(sha256, code_start, code_end, **{k: z[k] for k in cls.FIELDS})
+        graph = cls.build(code, code_start, code_end, sha256)
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, version=CFG_CACHE_VERSION, **{k: getattr(graph, k) for k in cls.FIELDS})
+        os.replace(tmp, path)
+        return graph
+
+    def block_of(self, addr):
+        return int(np.searchsorted(self.block_start, addr, side='right')) - 1
+
+    def function_containing(self, addr):
+        """按 BL 目标和函数序言切分函数，返回 (函数起点, 终点)"""
+        i = int(np.searchsorted(self.func_start, addr, side='right')) - 1
+        start = int(self.func_start[max(i, 0)])
+        end = int(self.func_start[i + 1]) if i + 1 < len(self.func_start) else self.code_end
+        return start, end
+
+    def successors(self, block):
+        if self._succ is None:
+            self._succ = np.searchsorted(self.edge_src, np.arange(len(self.block_start) + 1))
+        return self.edge_dst[self._succ[block]:self._succ[block + 1]]
+
+    def dominators(self, addr):
+        """函数入口到 addr 所在块的所有支配块 (函数内局部 CFG，迭代求解)"""
+        fstart, fend = self.function_containing(addr)
+        first = self.block_of(fstart)
+        last = int(np.searchsorted(self.block_start, fend, side='left'))
+        blocks = range(first, last)
+        preds = {b: [] for b in blocks}
+        for b in blocks:
+            for s in self.successors(b).tolist():
+                if first <= s < last:
+                    preds[s].append(b)
+        everything = set(blocks)
+        dom = {b: set(everything) for b in blocks}
+        dom[first] = {first}
+        changed = True
+        while changed:
+            changed = False
+            for b in blocks:
+                if b == first:
+                    continue
+                ps = [dom[p] for p in preds[b]]
+                new = set.intersection(*ps) | {b} if ps else {b}
+                if new != dom[b]:
+                    dom[b] = new
+                    changed = True
+        return sorted(dom[self.block_of(addr)])
+
+    def dominating_branches(self, addr):
+        """支配 addr 的条件分支地址列表 (也就是走到 addr 之前必定经过的判断)"""
+        result = []
+        for b in self.dominators(addr):
+            last = int(self.block_end[b]) - 4
+            i = int(np.searchsorted(self.br_addr, last))
+            if i < len(self.br_addr) and self.br_addr[i] == last and self.br_type[i] == BR_COND \
+                    and last < addr:
+                result.append(last)
+        return result
+
+    def disasm_function(self, code, addr):
+        """只反汇编 addr 所在函数 (lite 模式)"""
+        start, end = self.function_containing(addr)
+        md = Cs(CS_ARCH_ARM64, CS_MODE_LITTLE_ENDIAN)
+        md.detail = False
+        md.skipdata = True
+        return list(md.disasm_lite(code[start:end], start))
+
+
+def report_anchors(filename, anchors, cache_dir=XREF_CACHE_DIR, base=None):
+    # 多锚点批量查询：索引只建一次，之后每个锚点都是二分查找
     with open(filename, 'rb') as f:
         code = f.read()
+    index = XrefIndex.load_or_build(code, cache_dir, base)
+    print(f"[*] {filename} sha256={index.sha256[:16]}... 加载基址 {hex(index.base)}, "
+          f"字符串 {len(index.str_offsets)} 条, 引用 {len(index.ref_addrs)} 条")
+    for anchor in anchors:
+        found = index.refs_to_string(code, anchor.encode('utf-8'))
+        if not found:
+            print(f"[-] 找不到字符串 {anchor!r}")
+            continue
+        for pos, refs in found.items():
+            print(f"[*] {anchor!r} @ {hex(pos)}: {len(refs)} 处引用")
+            for addr, kind, target in refs:
+                print(f"    {hex(addr):<10} {kind:<5} -> {hex(target)}")
+
+
+def scan_firmware_v2(filename='623.8.1.bin', base=None, cfg=False):
+    with instrument.stage('load'), open(filename, 'rb') as f:
+        code = f.read()
+        instrument.count(read=len(code))
 
     # 1. 寻找标准锚点字符串 "SF: Detected"
     # 这是 U-Boot 原生代码，编译器通常会生成标准的引用指令，比较好抓
     anchor_str = b'SF: Detected'
     anchor_offset = code.find(anchor_str)
-    
+
     if anchor_offset == -1:
         print("Error: 找不到标准字符串 anchor")
         return
@@ -30,57 +546,28 @@ def scan_firmware_v2():
         return
 
     md = Cs(CS_ARCH_ARM64, CS_MODE_LITTLE_ENDIAN)
-    md.detail = True
+    # 只用到助记符/操作数/字节，不需要 detail
+    md.detail = False
 
     print("[*] 正在扫描引用锚点的代码 (反向追踪)...")
-    
-    # 扫描整个代码段 (前 1MB)
+
+    # 同时寻找 ADR / ADRP+ADD (相对) 和 LDR (加载文字池)，整个镜像一次批量解码
+    # 有 numpy 时走磁盘缓存的索引，同一镜像第二次起不再重新扫描
+    # LDR 加载的是运行地址，先推断 U-Boot 加载基址再换算回文件偏移
+    if HAS_NUMPY:
+        index = XrefIndex.load_or_build(code, base=base)
+        print(f"[*] 加载基址: {hex(index.base)}" + (" (自动推断)" if base is None else ""))
+        refs = index.refs_to(*anchor_range(anchor_offset))
+    else:
+        with instrument.stage('xref scan', read=len(code)):
+            refs = find_refs(code, [anchor_range(anchor_offset)])
     found_refs = []
-    
-    # 优化扫描：同时寻找 ADR (相对) 和 LDR (加载文字池)
-    # 遍历所有 4 字节对齐的地址
-    limit = min(len(code), 0xC0000) # 只扫前 768KB
-    
-    for addr in range(0, limit, 4):
-        # 读 4 字节指令
-        raw = code[addr:addr+4]
-        insn_val = struct.unpack('<I', raw)[0]
-        
-        # --- 检查 1: ADR 指令 ---
-        # 100xxxxx ...
-        if (insn_val & 0x1F000000) == 0x10000000:
-            # 手动解码 ADR 偏移
-            immlo = (insn_val >> 29) & 0x3
-            immhi = (insn_val >> 5) & 0x7FFFF
-            imm = (immhi << 2) | immlo
-            if imm & 0x100000: imm -= 0x200000 # Sign extend
-            
-            target = addr + imm
-            # 如果指向了锚点附近 (允许 64 字节误差)
-            if abs(target - anchor_offset) < 64:
-                print(f"[!] 发现 ADR 引用在: {hex(addr)} -> 指向 {hex(target)}")
-                found_refs.append(addr)
-
-        # --- 检查 2: LDR (Literal) 指令 ---
-        # 00011000 ... (LDR Xd, label)
-        elif (insn_val & 0xFF000000) == 0x58000000:
-            imm19 = (insn_val >> 5) & 0x7FFFF
-            offset = imm19 << 2
-            # Sign extend
-            if offset & 0x100000: offset -= 0x200000
-            
-            target = addr + offset
-            # 检查目标地址内存里存放的是不是 anchor_offset
-            # LDR 加载的是一个地址值，这个地址值指向字符串
-            if 0 <= target < len(code) - 8:
-                # 读取内存里的值
-                ptr_val = struct.unpack('<Q', code[target:target+8])[0]
-                # U-Boot 会重定位，但在静态文件里，它可能是一个相对小的偏移，或者绝对地址
-                # 这是一个难点，如果 Base 不为 0。
-                # 但我们可以试着检查 ptr_val 是否等于 anchor_offset (假设 Base=0)
-                if abs(ptr_val - anchor_offset) < 64:
-                    print(f"[!] 发现 LDR 引用在: {hex(addr)} -> 加载值 {hex(ptr_val)}")
-                    found_refs.append(addr)
+    for addr, kind, target in refs:
+        if kind == 'LDR':
+            print(f"[!] 发现 LDR 引用在: {hex(addr)} -> 加载值 {hex(target)}")
+        else:
+            print(f"[!] 发现 {kind} 引用在: {hex(addr)} -> 指向 {hex(target)}")
+        found_refs.append(addr)
 
     # 3. 打印关键代码段
     if found_refs:
@@ -88,30 +575,61 @@ def scan_firmware_v2():
         print("!!! 捕捉到关键嫌疑代码 !!!")
         print("请把下面这些指令完整发给我！我们要找的破解点就在这里面！")
         print("="*80)
-        
+
         # 我们取第一个发现的引用点，往上倒推 200 字节
         # 因为 Key Check 肯定在 Detect 之前执行
         ref = found_refs[0]
         start = max(0, ref - 256)
         end = min(len(code), ref + 64)
-        
+
         snippet = code[start:end]
-        
+
         print(f"{'Addr':<10} {'Machine Code':<24} {'Assembly'}")
         print("-" * 60)
-        
+
         for insn in md.disasm(snippet, start):
             # 标记引用点
             marker = " <=== 标准检测逻辑" if insn.address == ref else ""
-            
+
             # 简单着色: 这里的 B.NE, TBZ 等跳转指令是重点
             if insn.mnemonic.startswith('b') or insn.mnemonic.startswith('c') or insn.mnemonic.startswith('t'):
                  marker += " [Check?]"
-            
+
             bytes_str = ' '.join([f'{b:02x}' for b in insn.bytes])
             print(f"{hex(insn.address):<10} {bytes_str:<24} {insn.mnemonic:<10} {insn.op_str:<20}{marker}")
+
+        # 整段代码区建图 (有缓存)，给出引用所在函数和必经的条件分支
+        if cfg and HAS_NUMPY:
+            graph = CodeGraph.load_or_build(code)
+            for ref in found_refs:
+                if not graph.code_start <= ref < graph.code_end:
+                    continue
+                fstart, fend = graph.function_containing(ref)
+                branches = graph.dominating_branches(ref)
+                print(f"\n[*] {hex(ref)} 位于函数 {hex(fstart)}-{hex(fend)}，"
+                      f"支配它的条件分支: {', '.join(hex(b) for b in branches) or '无'}")
     else:
         print("[-] 依然没找到直接引用... 厂家可能用了非常复杂的代码混淆。")
 
 if __name__ == "__main__":
-    scan_firmware_v2()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('image', nargs='?', default='623.8.1.bin')
+    parser.add_argument('--anchor', action='append', default=[],
+                        help='只查询这些字符串的引用 (可重复)，使用缓存索引')
+    parser.add_argument('--base', type=lambda v: int(v, 0), default=None,
+                        help='U-Boot 加载基址 (默认自动推断)')
+    parser.add_argument('--cfg', action='store_true',
+                        help='反汇编整个 U-Boot 代码区建立分支图 (缓存)，报告引用所在函数和支配分支')
+    parser.add_argument('--corpus', metavar='DIR',
+                        help='扫描目录里的所有镜像并比较各版本的差异 (见 corpus.py)')
+    parser.add_argument('--trace', help='把各阶段耗时/字节数写到这个 JSON 文件')
+    args = parser.parse_args()
+    if args.trace:
+        instrument.enable(args.trace)
+    if args.corpus:
+        from corpus import DEFAULT_ANCHORS, list_images, scan_corpus, print_report
+        print_report(scan_corpus(list_images(args.corpus), args.anchor or DEFAULT_ANCHORS))
+    elif args.anchor:
+        report_anchors(args.image, args.anchor, base=args.base)
+    else:
+        scan_firmware_v2(args.image, args.base, args.cfg)
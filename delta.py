@@ -0,0 +1,204 @@
+import os
+import sys
+import struct
+import hashlib
+import binascii
+import argparse
+from image_io import FlashImage
+from crc_util import crc32_combine
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+# 增量补丁：基础镜像 sha256 + 目标镜像大小/CRC + 若干 (偏移, 数据) 段。
+# 每台设备的镜像和基础镜像只差 ENV/Vendor/DTB 几 KB，存补丁而不是 8MB 全量。
+DELTA_MAGIC = b'CDDELTA1'
+_HEADER = struct.Struct('<8s32sIII')   # 魔数, 基础 sha256, 目标大小, 目标 crc32, 段数
+_RUN = struct.Struct('<II')            # 偏移, 长度
+
+# 两段差异之间相同的字节不超过这么多时合并成一段 (省掉一个段头)
+MERGE_GAP = 16
+
+
+def diff_runs(base, target, gap=MERGE_GAP, block=0x1000):
+    """返回 target 相对 base 的差异段 [(偏移, 长度)]；target 比 base 长的部分整段算差异"""
+    n = min(len(base), len(target))
+    spans = []
+    if HAS_NUMPY:
+        diff = np.nonzero(np.frombuffer(base, np.uint8, n) != np.frombuffer(target, np.uint8, n))[0]
+        if len(diff):
+            breaks = np.nonzero(np.diff(diff) > gap + 1)[0]
+            starts = np.concatenate(([diff[0]], diff[breaks + 1]))
+            ends = np.concatenate((diff[breaks], [diff[-1]])) + 1
+            spans = [(int(s), int(e)) for s, e in zip(starts, ends)]
+    else:
+        a, b = memoryview(base), memoryview(target)
+        for off in range(0, n, block):
+            end = min(off + block, n)
+            if a[off:end] == b[off:end]:
+                continue
+            diffs = [i for i in range(off, end) if a[i] != b[i]]
+            for i in diffs:
+                if spans and i - spans[-1][1] <= gap:
+                    spans[-1] = (spans[-1][0], i + 1)
+                else:
+                    spans.append((i, i + 1))
+    if len(target) > n:
+        if spans and n - spans[-1][1] <= gap:
+            spans[-1] = (spans[-1][0], len(target))
+        else:
+            spans.append((n, len(target)))
+    return [(s, e - s) for s, e in spans]
+
+
+def write_delta(path, base_sha256, target_size, target_crc, runs):
+    """runs = [(偏移, 数据)]"""
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(DELTA_MAGIC, base_sha256, target_size, target_crc, len(runs)))
+        for offset, blob in runs:
+            f.write(_RUN.pack(offset, len(blob)))
+            f.write(blob)
+    return os.path.getsize(path)
+
+
+def read_delta(path):
+    """返回 (基础 sha256, 目标大小, 目标 crc, [(偏移, 数据)])，格式不对时抛 ValueError"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < _HEADER.size:
+        raise ValueError(f"{path} 太短，不是增量补丁")
+    magic, base_sha256, size, crc, count = _HEADER.unpack_from(data)
+    if magic != DELTA_MAGIC:
+        raise ValueError(f"{path} 不是增量补丁 (魔数 {magic!r})")
+    mv = memoryview(data)
+    pos, runs = _HEADER.size, []
+    for _ in range(count):
+        if pos + _RUN.size > len(data):
+            raise ValueError(f"{path} 数据不完整")
+        offset, length = _RUN.unpack_from(data, pos)
+        pos += _RUN.size
+        if pos + length > len(data) or offset + length > size:
+            raise ValueError(f"{path} 第 {len(runs)} 段越界")
+        runs.append((offset, mv[pos:pos + length]))
+        pos += length
+    return base_sha256, size, crc, runs
+
+
+def make_delta(base_path, target_path, delta_path):
+    """比较两个镜像生成补丁，返回补丁大小"""
+    with FlashImage.open(base_path) as base, FlashImage.open(target_path) as target:
+        runs = [(off, target.view(off, length)) for off, length in diff_runs(base.buf, target.buf)]
+        return write_delta(delta_path, hashlib.sha256(base.buf).digest(), target.size,
+                           binascii.crc32(target.buf) & 0xFFFFFFFF, runs)
+
+
+def apply_delta(delta_path, base_path, out_path):
+    """基础镜像整块复制 (copy_file_range) + 覆盖各段，校验 sha256/CRC；失败时删除输出并抛 ValueError"""
+    base_sha256, size, crc, runs = read_delta(delta_path)
+    with FlashImage.open(base_path) as base:
+        if hashlib.sha256(base.buf).digest() != base_sha256:
+            raise ValueError(f"{base_path} 不是这个补丁的基础镜像 (sha256 不符)")
+        out = FlashImage.create(out_path, size)
+        out.copy_from(base, 0, 0, min(size, base.size))
+    for offset, blob in runs:
+        out.write(offset, blob)
+    actual = binascii.crc32(out.buf) & 0xFFFFFFFF
+    out.close()
+    if actual != crc:
+        os.remove(out_path)
+        raise ValueError(f"还原后的 CRC {actual:#010x} 与补丁记录的 {crc:#010x} 不符")
+    return size
+
+
+class DeltaTemplate:
+    """同一基础镜像、同样几个固定位置的批量补丁 (Fleet)：
+
+    sha256 和各段之间未改动部分的 CRC 只算一次，每个补丁的目标 CRC 用
+    crc32_combine 拼出来，不用真正生成 8MB 镜像。
+    """
+
+    def __init__(self, base, slots):
+        self.slots = sorted(slots)
+        self.size = len(base)
+        self.base_sha256 = hashlib.sha256(base).digest()
+        # gaps[i] = 第 i 段之前那段未改动数据的 (crc, 长度)
+        self.gaps = []
+        pos = 0
+        for offset, length in self.slots + [(self.size, 0)]:
+            if offset < pos:
+                raise ValueError("补丁位置互相重叠")
+            self.gaps.append((binascii.crc32(base[pos:offset]), offset - pos))
+            pos = offset + length
+
+    def target_crc(self, blobs):
+        crc = self.gaps[0][0]
+        for blob, (gap_crc, gap_len) in zip(blobs, self.gaps[1:]):
+            crc = crc32_combine(crc, binascii.crc32(blob), len(blob))
+            crc = crc32_combine(crc, gap_crc, gap_len)
+        return crc & 0xFFFFFFFF
+
+    def write(self, path, blobs):
+        """blobs 与 slots 一一对应 (按偏移排序、长度相同)"""
+        for blob, (_, length) in zip(blobs, self.slots):
+            if len(blob) != length:
+                raise ValueError("补丁段长度与模板不符")
+        runs = [(offset, blob) for (offset, _), blob in zip(self.slots, blobs)]
+        return write_delta(path, self.base_sha256, self.size, self.target_crc(blobs), runs)
+
+
+def emit_delta(base_path, target_path, regions, keep_target=False):
+    """补丁脚本的 --delta 输出：脚本自己知道改了哪几块 (regions = [(偏移, 长度)])，
+    只比对这几块写成 .delta，不再整镜像比对；默认删掉全量镜像"""
+    delta_path = os.path.splitext(target_path)[0] + '.delta'
+    with FlashImage.open(base_path) as base, FlashImage.open(target_path) as target:
+        if base.size != target.size:
+            raise ValueError(f"{target_path} 和 {base_path} 大小不同")
+        # 只在这几块里比对，去掉没变的部分
+        runs = [(offset + start, length)
+                for offset, region_len in regions
+                for start, length in diff_runs(base.view(offset, region_len), target.view(offset, region_len))]
+        template = DeltaTemplate(base.buf, runs)
+        size = template.write(delta_path, [bytes(target.view(offset, length))
+                                           for offset, length in template.slots])
+    if not keep_target:
+        os.remove(target_path)
+    print(f"增量补丁: {delta_path} ({size} 字节，基础镜像 {base_path})")
+    return delta_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='生成/查看/应用增量补丁')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('make', help='比较两个镜像生成补丁')
+    p.add_argument('base')
+    p.add_argument('target')
+    p.add_argument('-o', '--output')
+    p = sub.add_parser('apply', help='基础镜像 + 补丁 -> 完整镜像')
+    p.add_argument('delta')
+    p.add_argument('base')
+    p.add_argument('-o', '--output')
+    p = sub.add_parser('info', help='列出补丁内容')
+    p.add_argument('delta')
+    args = parser.parse_args()
+
+    try:
+        if args.cmd == 'make':
+            out = args.output or os.path.splitext(args.target)[0] + '.delta'
+            size = make_delta(args.base, args.target, out)
+            print(f"✅ {out}: {size} 字节")
+        elif args.cmd == 'apply':
+            out = args.output or os.path.splitext(args.delta)[0] + '.bin'
+            apply_delta(args.delta, args.base, out)
+            print(f"✅ {out} 已还原，CRC 校验通过")
+        else:
+            base_sha256, size, crc, runs = read_delta(args.delta)
+            print(f"基础镜像 sha256 {base_sha256.hex()}")
+            print(f"目标镜像 {size} 字节, CRC {crc:#010x}, {len(runs)} 段:")
+            for offset, blob in runs:
+                print(f"  {offset:#08x}  {len(blob):>6} 字节")
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
@@ -0,0 +1,266 @@
+import sys
+import struct
+import argparse
+from collections import namedtuple
+from image_io import FlashImage
+from locate import MAGIC_FDT
+
+# 设备树 (FDT) 的零拷贝读取和原地修改：直接在镜像的 memoryview 上按需遍历
+# 结构块，属性值都是切片；新值不比旧值长时原地改 (多出来的位置填 NOP)，
+# 变长才整体重新打包。
+FDT_BEGIN_NODE, FDT_END_NODE, FDT_PROP, FDT_NOP, FDT_END = 1, 2, 3, 4, 9
+FDT_HEADER_SIZE = 40
+
+# 属性在 blob 里的位置：token 所在偏移、值的偏移和长度
+Prop = namedtuple('Prop', 'name token offset length')
+
+
+def _align4(n):
+    return (n + 3) & ~3
+
+
+class Fdt:
+    """buf 是整个镜像 (或 DTB 本身) 的可写/只读缓冲，offset 是 DTB 起始位置"""
+
+    def __init__(self, buf, offset=0):
+        mv = memoryview(buf)
+        if mv[offset:offset + 4] != MAGIC_FDT:
+            raise ValueError(f"{hex(offset)} 处不是设备树")
+        (self.totalsize, self.off_struct, self.off_strings, self.off_rsvmap, self.version,
+         self.last_comp, self.boot_cpuid, self.size_strings, self.size_struct) = \
+            struct.unpack_from('>9I', mv, offset + 4)
+        if self.version < 16 or offset + self.totalsize > len(mv) or \
+                self.off_struct >= self.totalsize or self.off_strings > self.totalsize:
+            raise ValueError(f"{hex(offset)} 处设备树头异常")
+        self.mv = mv[offset:offset + self.totalsize]
+        self.repacked = False
+
+    @property
+    def blob(self):
+        return self.mv
+
+    def _string(self, off):
+        start = self.off_strings + off
+        end = start
+        while self.mv[end]:
+            end += 1
+        return bytes(self.mv[start:end]).decode('ascii')
+
+    def walk(self):
+        """按顺序产出 ('node', 路径, token 偏移) / ('prop', 路径, Prop) / ('end', 路径, token 偏移)"""
+        mv, pos, path = self.mv, self.off_struct, []
+        end = self.off_struct + self.size_struct if self.version >= 17 else len(mv)
+        while pos < end:
+            token, = struct.unpack_from('>I', mv, pos)
+            if token == FDT_BEGIN_NODE:
+                name_end = pos + 4
+                while mv[name_end]:
+                    name_end += 1
+                path.append(bytes(mv[pos + 4:name_end]).decode('ascii'))
+                yield 'node', '/' + '/'.join(path[1:]), pos
+                pos = _align4(name_end + 1)
+            elif token == FDT_END_NODE:
+                yield 'end', '/' + '/'.join(path[1:]), pos
+                path.pop()
+                pos += 4
+            elif token == FDT_PROP:
+                length, nameoff = struct.unpack_from('>II', mv, pos + 4)
+                yield 'prop', '/' + '/'.join(path[1:]), Prop(self._string(nameoff), pos, pos + 12, length)
+                pos = _align4(pos + 12 + length)
+            elif token == FDT_NOP:
+                pos += 4
+            elif token == FDT_END:
+                return
+            else:
+                raise ValueError(f"设备树结构块在 {hex(pos)} 处有未知 token {token:#x}")
+
+    def find_prop(self, path, name):
+        """找到就停，不遍历剩下的部分"""
+        for kind, node, item in self.walk():
+            if kind == 'prop' and node == path and item.name == name:
+                return item
+        return None
+
+    def props_named(self, name):
+        """所有节点里名字为 name 的属性 [(路径, Prop)]"""
+        return [(node, item) for kind, node, item in self.walk() if kind == 'prop' and item.name == name]
+
+    def get(self, path, name):
+        """属性值 (memoryview 切片，不复制)；没有时返回 None"""
+        prop = self.find_prop(path, name)
+        return None if prop is None else self.mv[prop.offset:prop.offset + prop.length]
+
+    def set(self, path, name, value):
+        """写属性。新值放得下就原地改，返回 True；否则重新打包 (self.mv 换成新 blob)，返回 False"""
+        value = bytes(value)
+        prop = self.find_prop(path, name)
+        if prop is not None and _align4(len(value)) <= _align4(prop.length) and not self.mv.readonly:
+            old_end = _align4(prop.offset + prop.length)
+            new_end = _align4(prop.offset + len(value))
+            struct.pack_into('>I', self.mv, prop.token + 4, len(value))
+            self.mv[prop.offset:prop.offset + len(value)] = value
+            self.mv[prop.offset + len(value):new_end] = bytes(new_end - prop.offset - len(value))
+            # 变短腾出的 4 字节槽填 FDT_NOP，结构块其它部分位置不变
+            self.mv[new_end:old_end] = struct.pack('>I', FDT_NOP) * ((old_end - new_end) // 4)
+            return True
+        self._repack(path, name, value)
+        return False
+
+    def _repack(self, path, name, value):
+        # 重新生成：头 + 保留区表 + 结构块 (替换这个属性，或插到节点的属性末尾) + 字符串块
+        strings = bytearray(self.mv[self.off_strings:self.off_strings + self.size_strings])
+        name_b = name.encode('ascii') + b'\0'
+        nameoff = bytes(strings).find(name_b)
+        while nameoff > 0 and strings[nameoff - 1] != 0:
+            nameoff = bytes(strings).find(name_b, nameoff + 1)
+        if nameoff < 0:
+            nameoff = len(strings)
+            strings += name_b
+
+        def prop_blob():
+            blob = struct.pack('>III', FDT_PROP, len(value), nameoff) + value
+            return blob + bytes(-len(blob) % 4)
+
+        out = bytearray()
+        done = False
+        pos = self.off_struct
+        for kind, node, item in self.walk():
+            start = item.token if kind == 'prop' else item
+            out += self.mv[pos:start]      # 中间的 NOP 原样保留
+            if kind == 'prop':
+                pos = _align4(item.offset + item.length)
+                if node == path and item.name == name:
+                    out += prop_blob()
+                    done = True
+                    continue
+                out += self.mv[item.token:pos]
+            elif kind == 'end':
+                if node == path and not done:
+                    out += prop_blob()
+                    done = True
+                out += self.mv[item:item + 4]
+                pos = item + 4
+            else:
+                # 属性必须在子节点之前 (libfdt/内核遇到第一个子节点就不再找属性)，
+                # 新属性插到目标节点的第一个子节点前面
+                if not done and node != path and (node.rsplit('/', 1)[0] or '/') == path:
+                    out += prop_blob()
+                    done = True
+                name_end = start + 4
+                while self.mv[name_end]:
+                    name_end += 1
+                pos = _align4(name_end + 1)
+                out += self.mv[start:pos]
+        if not done:
+            raise ValueError(f"设备树里没有节点 {path}")
+        out += struct.pack('>I', FDT_END)
+
+        rsv_end = self.off_rsvmap
+        while struct.unpack_from('>QQ', self.mv, rsv_end) != (0, 0):
+            rsv_end += 16
+        rsvmap = bytes(self.mv[self.off_rsvmap:rsv_end + 16])
+
+        off_rsvmap = FDT_HEADER_SIZE
+        off_struct = off_rsvmap + len(rsvmap)
+        off_strings = off_struct + len(out)
+        total = off_strings + len(strings)
+        header = struct.pack('>10I', int.from_bytes(MAGIC_FDT, 'big'), total, off_struct, off_strings,
+                             off_rsvmap, max(self.version, 17), self.last_comp, self.boot_cpuid,
+                             len(strings), len(out))
+        blob = bytearray(header + rsvmap + out + strings)
+        self.__init__(blob)
+        self.repacked = True
+
+
+def set_string(fdt, path, name, text):
+    return fdt.set(path, name, text.encode('ascii') + b'\0')
+
+
+def set_u32s(fdt, path, name, values):
+    return fdt.set(path, name, struct.pack(f'>{len(values)}I', *values))
+
+
+def set_mac(fdt, mac_str):
+    """所有以太网节点里的 local-mac-address / mac-address (6 字节) 都改成 mac_str，返回改了几处"""
+    mac = bytes.fromhex(mac_str.replace(':', ''))
+    count = 0
+    for name in ('local-mac-address', 'mac-address'):
+        for node, prop in fdt.props_named(name):
+            if prop.length == 6:
+                fdt.set(node, name, mac)
+                count += 1
+    return count
+
+
+def write_back(image, offset, fdt, limit):
+    """把 (可能重新打包过的) DTB 写回镜像 offset 处，不能超过 limit；原地修改过的无需写回"""
+    if not fdt.repacked:
+        return
+    if offset + len(fdt.blob) > limit:
+        raise ValueError(f"重新打包后的设备树 {len(fdt.blob)} 字节，放不进 {hex(offset)}-{hex(limit)}")
+    image.write(offset, fdt.blob)
+
+
+def format_value(value):
+    raw = bytes(value)
+    if raw and raw[0] and raw[-1] == 0 and b'\0\0' not in raw and \
+            all(32 <= c < 127 for c in raw[:-1].replace(b'\0', b' ')):
+        return ' '.join(repr(s.decode('ascii')) for s in raw[:-1].split(b'\0'))
+    if len(raw) % 4 == 0 and 0 < len(raw) <= 64:
+        return '<' + ' '.join(f'{v:#x}' for v in struct.unpack(f'>{len(raw) // 4}I', raw)) + '>'
+    return f'[{len(raw)} bytes] ' + raw[:16].hex() + ('...' if len(raw) > 16 else '')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='查看/修改镜像里的设备树属性 (原地修改，不复制整个 DTB)')
+    parser.add_argument('image')
+    parser.add_argument('--offset', type=lambda v: int(v, 0), default=0xD1000)
+    parser.add_argument('--list', action='store_true', help='列出所有节点和属性')
+    parser.add_argument('--get', nargs=2, metavar=('PATH', 'NAME'))
+    parser.add_argument('--set', nargs=3, metavar=('PATH', 'NAME', 'TEXT'), help='写字符串属性')
+    parser.add_argument('--set-u32', nargs=3, metavar=('PATH', 'NAME', 'V1,V2,...'), help='写 u32 数组属性')
+    parser.add_argument('--mac', help='修改所有 local-mac-address / mac-address')
+    parser.add_argument('--limit', type=lambda v: int(v, 0), default=None,
+                        help='变长需要重新打包时，DTB 最多写到这个偏移 (默认不允许变长)')
+    args = parser.parse_args()
+
+    editing = args.set or args.set_u32 or args.mac
+    try:
+        image = FlashImage(args.image, writable=bool(editing))
+    except OSError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    try:
+        fdt = Fdt(image.buf, args.offset)
+        print(f">>> {args.image} @ {hex(args.offset)}: FDT v{fdt.version}, {fdt.totalsize} 字节")
+        if args.list:
+            depth = 0
+            for kind, node, item in fdt.walk():
+                if kind == 'node':
+                    print(f"{'  ' * depth}{node.rsplit('/', 1)[-1] or '/'} {{")
+                    depth += 1
+                elif kind == 'end':
+                    depth -= 1
+                    print(f"{'  ' * depth}}}")
+                else:
+                    value = fdt.mv[item.offset:item.offset + item.length]
+                    print(f"{'  ' * depth}{item.name} = {format_value(value)}")
+        if args.get:
+            value = fdt.get(*args.get)
+            print(f"{args.get[0]} {args.get[1]} = " + ("(不存在)" if value is None else format_value(value)))
+        if editing:
+            limit = args.limit if args.limit is not None else args.offset + fdt.totalsize
+            if args.set:
+                set_string(fdt, *args.set)
+            if args.set_u32:
+                path, name, values = args.set_u32
+                set_u32s(fdt, path, name, [int(v, 0) for v in values.split(',')])
+            if args.mac:
+                print(f"MAC 已写入 {set_mac(fdt, args.mac)} 处")
+            write_back(image, args.offset, fdt, limit)
+            print("✅ 已重新打包写回" if fdt.repacked else "✅ 已原地修改")
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    finally:
+        image.close()
@@ -1,8 +1,10 @@
-import struct
-import binascii
 import os
+import argparse
+from image_io import FlashImage, FLASH_SIZE
+from delta import emit_delta
+from uboot_env import serialize
 
-def final_fix():
+def final_fix(delta=False):
     file_path = 'old.bin'
     output_path = 'fixed_old.bin'
     
@@ -14,11 +16,11 @@ def final_fix():
         print(f"找不到 {file_path}")
         return
 
-    # 读取原始数据
-    with open(file_path, 'rb') as f:
-        full_data = bytearray(f.read())
+    # 复制一份再原地修改 (mmap)，不把整个镜像读进内存
+    image = FlashImage.clone(file_path, output_path)
+    full_data = image.buf
     
-    if len(full_data) != 8388608:
+    if len(full_data) != FLASH_SIZE:
         print(f"警告：原始文件大小不是8MB，当前为 {len(full_data)} 字节")
 
     # 1. 构建干净的环境变量字典
@@ -29,34 +31,26 @@ def final_fix():
         b'ethaddr': b'00:11:32:A1:B2:C3', # 请在此处填入你的真实MAC
     }
 
-    # 2. 生成环境变量二进制块
-    env_payload = bytearray()
-    for k, v in env_dict.items():
-        env_payload += k + b'=' + v + b'\0'
-    env_payload += b'\0' # 结尾双空
+    # 2. 生成环境变量二进制块，严格限制长度为 ENV_SIZE (含 4 字节 CRC)
+    new_env_area, crc = serialize(env_dict, ENV_SIZE)
 
-    # 严格限制长度为 ENV_SIZE - 4 (CRC位)
-    env_block_data = env_payload.ljust(ENV_SIZE - 4, b'\x00')
-
-    # 3. 计算 CRC32
-    crc = binascii.crc32(env_block_data) & 0xFFFFFFFF
-    
-    # 组合成最终的 64KB 块
-    new_env_area = struct.pack('<I', crc) + env_block_data
-
-    # 4. 精准缝合：原地替换，不改变前后数据位置
+    # 3. 精准缝合：原地替换，不改变前后数据位置
     full_data[ENV_OFFSET : ENV_OFFSET + ENV_SIZE] = new_env_area
 
-    # 5. 输出
-    with open(output_path, 'wb') as f:
-        f.write(full_data)
+    # 4. 输出
+    size = image.size
+    image.close()
     
     print("--- 修复报告 ---")
     print(f"1. 环境变量起始地址: {hex(ENV_OFFSET)}")
     print(f"2. 写入 CRC32 值: {hex(crc)}")
-    print(f"3. 最终文件大小: {len(full_data)} (必须是8388608)")
+    print(f"3. 最终文件大小: {size} (必须是8388608)")
     print("----------------")
     print("修复完成！请将 fixed_old.bin 刷入。")
+    if delta:
+        emit_delta(file_path, output_path, [(ENV_OFFSET, ENV_SIZE)])
 
 if __name__ == "__main__":
-    final_fix()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--delta', action='store_true', help='只输出相对 old.bin 的增量补丁')
+    final_fix(parser.parse_args().delta)
@@ -0,0 +1,117 @@
+import os
+import argparse
+import instrument
+from image_io import FlashImage
+
+# SPI NOR 的两种擦除粒度：4KB 扇区 / 64KB 块
+SECTOR_4K = 0x1000
+BLOCK_64K = 0x10000
+
+# U-Boot 里放待写数据的内存地址 (和 bootcmd 一样用 0x1000000)
+LOAD_ADDR = 0x1000000
+
+# 粗略的时间模型 (可用参数覆盖)：擦除按次计，写入按吞吐计
+ERASE_MS = {SECTOR_4K: 45, BLOCK_64K: 150}
+WRITE_KBPS = 500
+
+
+def dirty_units(current, target, unit):
+    """逐个擦除单元比较，返回内容不同的单元起始偏移 (先按 64KB 粗比，再细分)"""
+    size = min(current.size, target.size)
+    coarse = max(unit, BLOCK_64K)
+    dirty = []
+    for block in range(0, size, coarse):
+        end = min(block + coarse, size)
+        if current.buf[block:end] == target.buf[block:end]:
+            continue
+        for off in range(block, end, unit):
+            if current.buf[off:off + unit] != target.buf[off:off + unit]:
+                dirty.append(off)
+    return dirty
+
+
+def merge_runs(offsets, unit, max_gap=0):
+    """相邻 (或间隔不超过 max_gap 个单元) 的脏单元合并成 [(start, length)]"""
+    runs = []
+    for off in offsets:
+        if runs and off - (runs[-1][0] + runs[-1][1]) <= max_gap * unit:
+            start = runs[-1][0]
+            runs[-1] = (start, off + unit - start)
+        else:
+            runs.append((off, unit))
+    return runs
+
+
+def is_erased(buf):
+    return bytes(buf) == b'\xff' * len(buf)
+
+
+def plan_flash(current_file, target_file, erase_size=BLOCK_64K, max_gap=0):
+    """返回写入计划：[(start, length, 是否需要写数据)]"""
+    with instrument.stage('diff'), \
+            FlashImage.open(current_file) as current, FlashImage.open(target_file) as target:
+        if current.size != target.size:
+            raise ValueError(f"两个镜像大小不同: {current.size} vs {target.size}")
+        runs = merge_runs(dirty_units(current, target, erase_size), erase_size, max_gap)
+        # 目标内容全是 0xFF 的区间只需要擦除，不用传数据
+        return [(start, length, not is_erased(target.buf[start:start + length]))
+                for start, length in runs]
+
+
+def estimate_ms(plan, erase_size, erase_ms=None, write_kbps=WRITE_KBPS):
+    erase_ms = ERASE_MS.get(erase_size, 150) if erase_ms is None else erase_ms
+    total = 0.0
+    for start, length, write in plan:
+        total += length // erase_size * erase_ms
+        if write:
+            total += length / 1024 / write_kbps * 1000
+    return total
+
+
+def emit_script(plan, target_file, out_dir, load_cmd, load_addr=LOAD_ADDR):
+    """写出每段的 payload 文件，并生成 U-Boot 命令序列"""
+    os.makedirs(out_dir, exist_ok=True)
+    lines = ['sf probe']
+    with FlashImage.open(target_file) as target:
+        for i, (start, length, write) in enumerate(plan):
+            lines.append(f'sf erase {hex(start)} {hex(length)}')
+            if not write:
+                continue
+            name = f'chunk_{i:02d}_{start:06x}.bin'
+            with open(os.path.join(out_dir, name), 'wb') as f:
+                f.write(target.view(start, length))
+            lines.append(f'{load_cmd} {hex(load_addr)} {name}')
+            lines.append(f'sf write {hex(load_addr)} {hex(start)} {hex(length)}')
+    script = os.path.join(out_dir, 'flash.txt')
+    with open(script, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return script, lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='对比 Flash 现状与目标镜像，生成最小的 sf erase/write 命令')
+    parser.add_argument('current', help='设备当前的 Flash dump')
+    parser.add_argument('target', help='要刷入的目标镜像')
+    parser.add_argument('--erase-size', type=lambda v: int(v, 0), default=BLOCK_64K,
+                        choices=(SECTOR_4K, BLOCK_64K), help='擦除粒度 0x1000 或 0x10000 (默认)')
+    parser.add_argument('--merge-gap', type=int, default=0,
+                        help='间隔不超过这么多个干净单元的脏区合并成一条命令')
+    parser.add_argument('--out-dir', default='flash_plan')
+    parser.add_argument('--load-cmd', default='fatload usb 0:1',
+                        help='把 payload 读进内存的命令前缀 (如 "tftpboot" 或 "fatload usb 0:1")')
+    parser.add_argument('--write-kbps', type=float, default=WRITE_KBPS)
+    args = parser.parse_args()
+
+    plan = plan_flash(args.current, args.target, args.erase_size, args.merge_gap)
+    if not plan:
+        print("两个镜像完全一致，无需刷写。")
+    else:
+        script, lines = emit_script(plan, args.target, args.out_dir, args.load_cmd)
+        size = os.path.getsize(args.target)
+        changed = sum(length for _, length, _ in plan)
+        full = [(0, size, True)]
+        print('\n'.join(lines))
+        print(f"\n>>> {len(plan)} 段, 共 {changed} 字节 ({changed * 100 / size:.1f}% 的 Flash)")
+        print(f">>> 预计耗时 {estimate_ms(plan, args.erase_size, write_kbps=args.write_kbps) / 1000:.1f}s, "
+              f"整片刷写约 {estimate_ms(full, args.erase_size, write_kbps=args.write_kbps) / 1000:.1f}s")
+        print(f">>> 命令已写入 {script}")
@@ -0,0 +1,130 @@
+import os
+import mmap
+import instrument
+
+FLASH_SIZE = 8388608  # 8MB SPI Flash
+
+# copy_file_range / sendfile 单次最多搬运的字节数
+_COPY_CHUNK = 0x40000000
+
+
+class FlashImage:
+    """mmap 映射的固件镜像，所有区域都以 memoryview 给出，不复制。
+
+    输出镜像直接在映射上原地修改；整段搬运优先走 os.copy_file_range /
+    os.sendfile，由内核在页缓存里完成，不经过 Python 缓冲区。
+    """
+
+    def __init__(self, path, writable=False):
+        self.path = path
+        self.writable = writable
+        self.fd = os.open(path, os.O_RDWR if writable else os.O_RDONLY)
+        self.size = os.fstat(self.fd).st_size
+        if not writable:
+            instrument.count(read=self.size)
+        access = mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ
+        self.map = mmap.mmap(self.fd, self.size, access=access)
+        self.buf = memoryview(self.map)
+
+    @classmethod
+    def open(cls, path):
+        return cls(path)
+
+    @classmethod
+    def create(cls, path, size=FLASH_SIZE, fill=0x00):
+        """新建 size 字节的输出镜像；0x00 填充直接用 ftruncate 的空洞，不写盘"""
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+        finally:
+            os.close(fd)
+        image = cls(path, writable=True)
+        if fill != 0x00:
+            image.fill(0, size, fill)
+        return image
+
+    @classmethod
+    def clone(cls, src_path, dst_path):
+        """把 src 整个复制成 dst 并以可写方式打开，用来在副本上原地打补丁"""
+        with cls.open(src_path) as src:
+            image = cls.create(dst_path, src.size)
+            image.copy_from(src, 0, 0, src.size)
+        return image
+
+    def view(self, offset, length):
+        return self.buf[offset:offset + length]
+
+    def write(self, offset, data):
+        self.buf[offset:offset + len(data)] = data
+        instrument.count(written=len(data))
+
+    def fill(self, offset, length, value):
+        # 分块填充，避免一次性构造整段填充字节
+        chunk = bytes([value]) * min(length, 0x10000)
+        instrument.count(written=length)
+        end = offset + length
+        while offset < end:
+            n = min(len(chunk), end - offset)
+            self.buf[offset:offset + n] = chunk[:n]
+            offset += n
+
+    def copy_from(self, src, src_offset, dst_offset, length):
+        """src[src_offset:] 的 length 字节复制到本镜像的 dst_offset 处"""
+        length = min(length, src.size - src_offset, self.size - dst_offset)
+        if length <= 0:
+            return 0
+        instrument.count(copied=length)
+        done = _kernel_copy(src.fd, self.fd, src_offset, dst_offset, length)
+        if done < length:
+            # 内核拷贝不可用 (跨文件系统/老内核)，退回 memoryview 拷贝
+            self.buf[dst_offset + done:dst_offset + length] = \
+                src.buf[src_offset + done:src_offset + length]
+        return length
+
+    def flush(self):
+        if self.writable:
+            self.map.flush()
+
+    def close(self):
+        if self.fd < 0:
+            return
+        self.flush()
+        try:
+            self.buf.release()
+            self.map.close()
+        except BufferError:
+            # 调用方还拿着切片，映射交给 GC 回收
+            pass
+        os.close(self.fd)
+        self.fd = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _kernel_copy(src_fd, dst_fd, src_offset, dst_offset, length):
+    # 返回内核已经复制的字节数；不支持时返回 0 由调用方兜底
+    done = 0
+    try:
+        while done < length:
+            n = os.copy_file_range(src_fd, dst_fd, min(length - done, _COPY_CHUNK),
+                                   src_offset + done, dst_offset + done)
+            if n == 0:
+                break
+            done += n
+        return done
+    except (AttributeError, OSError):
+        pass
+    try:
+        os.lseek(dst_fd, dst_offset + done, os.SEEK_SET)
+        while done < length:
+            n = os.sendfile(dst_fd, src_fd, src_offset + done, min(length - done, _COPY_CHUNK))
+            if n == 0:
+                break
+            done += n
+    except (AttributeError, OSError):
+        pass
+    return done
@@ -0,0 +1,118 @@
+import os
+import json
+import time
+import atexit
+
+# 分阶段性能记录：设置 CATDRIVE_TRACE=<文件> (或脚本的 --trace 参数) 时，
+# 每个阶段记下墙钟/CPU 时间和读、写、复制的字节数，退出时写成 JSON；
+# CATDRIVE_TRACE_FORMAT=chrome 时写 Chrome trace (chrome://tracing / Perfetto)。
+# 没打开时 stage() 返回同一个空上下文，count() 直接返回，几乎没有开销。
+TRACE_ENV = 'CATDRIVE_TRACE'
+TRACE_FORMAT_ENV = 'CATDRIVE_TRACE_FORMAT'
+
+_enabled = False
+_path = None
+_format = 'json'
+_owner = None
+_origin = 0.0
+_records = []
+_stack = []
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _NullStage()
+
+
+class _Stage:
+    __slots__ = ('name', 'read', 'written', 'copied', 'depth', '_wall', '_cpu')
+
+    def __init__(self, name, read=0, written=0, copied=0):
+        self.name = name
+        self.read, self.written, self.copied = read, written, copied
+
+    def __enter__(self):
+        self.depth = len(_stack)
+        _stack.append(self)
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        _stack.pop()
+        _records.append({
+            'name': self.name, 'depth': self.depth,
+            'start_us': (self._wall - _origin) * 1e6,
+            'wall_ms': wall * 1000, 'cpu_ms': cpu * 1000,
+            'bytes_read': self.read, 'bytes_written': self.written, 'bytes_copied': self.copied,
+        })
+        return False
+
+
+def enable(path, fmt=None):
+    """打开记录，进程退出时写到 path"""
+    global _enabled, _path, _format, _owner, _origin
+    if not _enabled:
+        atexit.register(dump)
+    _enabled = True
+    _path = path
+    _format = fmt or os.environ.get(TRACE_FORMAT_ENV, 'json')
+    _owner = os.getpid()
+    _origin = time.perf_counter()
+
+
+def enabled():
+    return _enabled
+
+
+def stage(name, read=0, written=0, copied=0):
+    """with stage('locate', read=len(data)): ... —— 记录这一段的时间和字节数"""
+    if not _enabled:
+        return _NULL
+    return _Stage(name, read, written, copied)
+
+
+def count(read=0, written=0, copied=0):
+    """把字节数记到当前最内层的阶段上"""
+    if not _enabled or not _stack:
+        return
+    s = _stack[-1]
+    s.read += read
+    s.written += written
+    s.copied += copied
+
+
+def records():
+    return list(_records)
+
+
+def dump(path=None):
+    # 进程池的子进程是 fork 出来的，只让主进程写文件
+    path = path or _path
+    if not path or os.getpid() != _owner:
+        return
+    if _format == 'chrome':
+        pid = os.getpid()
+        events = [{'name': r['name'], 'ph': 'X', 'pid': pid, 'tid': r['depth'],
+                   'ts': r['start_us'], 'dur': r['wall_ms'] * 1000,
+                   'args': {k: r[k] for k in ('cpu_ms', 'bytes_read', 'bytes_written', 'bytes_copied')}}
+                  for r in _records]
+        doc = {'traceEvents': events, 'displayTimeUnit': 'ms'}
+    else:
+        doc = {'stages': sorted(_records, key=lambda r: r['start_us'])}
+    with open(path, 'w') as f:
+        json.dump(doc, f, indent=1)
+
+
+if os.environ.get(TRACE_ENV):
+    enable(os.environ[TRACE_ENV])
@@ -0,0 +1,147 @@
+import os
+import sys
+import gzip
+import lzma
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from image_io import FlashImage
+from locate import component_at
+from bootcmd import FLASH_KERNEL, FLASH_RAMDISK, KERNEL_RAM_WINDOW, SPI_READ_MBPS, round_page
+
+# 内核在 Flash 里能占的空间：0xD5000 到 Ramdisk 之前
+KERNEL_SLOT = FLASH_RAMDISK - FLASH_KERNEL
+
+# A53 上 U-Boot 解压的输出吞吐 (MB/s)，粗略值，可用参数覆盖
+DECOMPRESS_MBPS = {'lzma': 20.0, 'gzip': 80.0, 'raw': None}
+
+# 候选编码：(名字, 编码, 参数)
+CANDIDATES = [('raw', 'raw', None)]
+CANDIDATES += [(f'lzma-{p}', 'lzma', p) for p in (0, 1, 3, 6, 9)]
+CANDIDATES += [('lzma-9e', 'lzma', 9 | lzma.PRESET_EXTREME)]
+CANDIDATES += [(f'gzip-{p}', 'gzip', p) for p in (1, 6, 9)]
+
+# 现有工具链能直接用的编码：bootcmd (sf_reads) 写死 lzmadec，validate.check_kernel
+# 也只认 LZMA 内核，所以 --emit 只在这些编码里选；其它编码只作比较参考
+EMIT_CODECS = ('lzma',)
+
+
+def extract_kernel(data, offset=FLASH_KERNEL):
+    """取出 hybrid 镜像里 0xD5000 处的 LZMA 内核，返回解压后的原始 Image"""
+    comp = component_at(data, offset, 'lzma')
+    if comp is None:
+        raise ValueError(f"{hex(offset)} 处不是 LZMA 内核")
+    return lzma.decompress(data[offset:offset + comp.length], format=lzma.FORMAT_ALONE)
+
+
+def compress(kernel, codec, level):
+    if codec == 'raw':
+        return kernel
+    if codec == 'lzma':
+        # U-Boot 的 lzmadec 只认 LZMA-alone 格式
+        return lzma.compress(kernel, format=lzma.FORMAT_ALONE, preset=level)
+    if codec == 'gzip':
+        return gzip.compress(kernel, compresslevel=level, mtime=0)
+    raise ValueError(codec)
+
+
+# 每个工作进程只接收一次内核数据，而不是每个候选都序列化一遍
+_worker_kernel = None
+
+
+def _worker_init(kernel):
+    global _worker_kernel
+    _worker_kernel = kernel
+
+
+def _try_candidate(job):
+    name, codec, level = job
+    start = time.perf_counter()
+    blob = compress(_worker_kernel, codec, level)
+    return name, codec, level, blob, time.perf_counter() - start
+
+
+def estimate_boot_ms(codec, packed_size, raw_size, spi_mbps=SPI_READ_MBPS, decompress_mbps=None):
+    """启动时加载内核的时间 = SPI 读取 + 解压"""
+    mbps = (decompress_mbps or DECOMPRESS_MBPS).get(codec)
+    read_ms = round_page(packed_size) / (spi_mbps * 1048576) * 1000
+    unpack_ms = raw_size / (mbps * 1048576) * 1000 if mbps else 0.0
+    return read_ms, unpack_ms
+
+
+def kernel_load_cmd(codec, packed_size):
+    """对应编码的 bootcmd 内核加载片段"""
+    size = round_page(packed_size)
+    if codec == 'raw':
+        return f'sf read 0x2000000 0x{FLASH_KERNEL:06X} {size:#x}; '
+    unpack = 'lzmadec' if codec == 'lzma' else 'unzip'
+    return f'sf read 0x1000000 0x{FLASH_KERNEL:06X} {size:#x}; {unpack} 0x1000000 0x2000000; '
+
+
+def advise(kernel, spi_mbps=SPI_READ_MBPS, decompress_mbps=None, workers=None):
+    """并行尝试所有候选编码，返回按预计加载时间排序的结果列表"""
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_worker_init,
+                             initargs=(kernel,)) as pool:
+        for name, codec, level, blob, seconds in pool.map(_try_candidate, CANDIDATES):
+            read_ms, unpack_ms = estimate_boot_ms(codec, len(blob), len(kernel), spi_mbps, decompress_mbps)
+            fits = round_page(len(blob)) <= KERNEL_SLOT and len(kernel) <= KERNEL_RAM_WINDOW
+            results.append({'name': name, 'codec': codec, 'size': len(blob), 'blob': blob,
+                            'read_ms': read_ms, 'unpack_ms': unpack_ms,
+                            'total_ms': read_ms + unpack_ms, 'fits': fits,
+                            'compress_s': seconds})
+    results.sort(key=lambda r: (not r['fits'], r['total_ms']))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='比较内核用不同压缩方式时的启动加载时间')
+    parser.add_argument('image', nargs='?', default='hybrid_ultimate.bin',
+                        help='hybrid_ultimate.py 生成的镜像 (内核在 0xD5000)')
+    parser.add_argument('--kernel', help='直接给出未压缩的内核 Image，而不是从镜像里提取')
+    parser.add_argument('--spi-mbps', type=float, default=SPI_READ_MBPS)
+    parser.add_argument('--lzma-mbps', type=float, default=DECOMPRESS_MBPS['lzma'])
+    parser.add_argument('--gzip-mbps', type=float, default=DECOMPRESS_MBPS['gzip'])
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--emit', help='把最快的、现有 bootcmd 能直接启动的 (LZMA) 方案写到这个文件')
+    args = parser.parse_args()
+
+    if args.kernel:
+        with open(args.kernel, 'rb') as f:
+            kernel = f.read()
+    else:
+        if not os.path.exists(args.image):
+            print(f"Error: 找不到 {args.image}")
+            sys.exit(1)
+        with FlashImage.open(args.image) as image:
+            kernel = extract_kernel(image.buf)
+
+    print(f">>> 内核原始大小 {len(kernel)} 字节, Flash 槽位 {hex(KERNEL_SLOT)}, "
+          f"SPI {args.spi_mbps:g}MB/s\n")
+    speeds = {'lzma': args.lzma_mbps, 'gzip': args.gzip_mbps, 'raw': None}
+    results = advise(kernel, args.spi_mbps, speeds, args.workers)
+
+    print(f"{'Codec':<10} {'Size':>10} {'Read':>9} {'Unpack':>9} {'Total':>9}  Fits")
+    print("-" * 56)
+    for r in results:
+        print(f"{r['name']:<10} {r['size']:>10} {r['read_ms']:>7.0f}ms {r['unpack_ms']:>7.0f}ms "
+              f"{r['total_ms']:>7.0f}ms  {'✅' if r['fits'] else '❌ 放不下'}")
+
+    best = results[0]
+    if not best['fits']:
+        print("\n❌ 没有任何方案能放进内核槽位！")
+        sys.exit(1)
+    print(f"\n>>> 最快方案: {best['name']} (预计 {best['total_ms']:.0f}ms)")
+    print(f">>> bootcmd 内核部分: {kernel_load_cmd(best['codec'], best['size'])}")
+    if args.emit:
+        usable = [r for r in results if r['fits'] and r['codec'] in EMIT_CODECS]
+        if not usable:
+            print(f"Error: {'/'.join(EMIT_CODECS)} 编码都放不进内核槽位，没有可写出的方案")
+            sys.exit(1)
+        if usable[0] is not best:
+            print(f">>> {best['name']} 需要改 bootcmd/校验才能启动，--emit 改用 {usable[0]['name']} "
+                  f"(预计 {usable[0]['total_ms']:.0f}ms)")
+            print(f">>> bootcmd 内核部分: {kernel_load_cmd(usable[0]['codec'], usable[0]['size'])}")
+        with open(args.emit, 'wb') as f:
+            f.write(usable[0]['blob'])
+        print(f">>> 已写入 {args.emit}，放到 Flash {hex(FLASH_KERNEL)}")
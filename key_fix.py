@@ -1,8 +1,17 @@
 import struct
 import binascii
 import os
+import argparse
+import instrument
+from image_io import FlashImage
+from bootcmd import boot_sizes, sf_reads, report_saving
+from validate import validate_boot_image
+from locate import locate_components, find_component
+from blockmap import warn_overwrites, LOW_ENTROPY, DATA
+from delta import emit_delta
+from uboot_env import payload
 
-def magic_fix_firmware():
+def magic_fix_firmware(delta=False):
     input_file = '623.8.1.bin'
     output_file = 'magic_623.bin'
     
@@ -16,30 +25,51 @@ def magic_fix_firmware():
     KERNEL_START = 0xD5000
     ENV_END = 0xE0000  # U-Boot 默认环境变量结束位置 (64KB)
     
-    # 原始 DTB 位置
+    # 原始 DTB 位置 (长度从 FDT 头读取)
     DTB_SOURCE = 0xB0750
-    DTB_SIZE = 6914
 
     if not os.path.exists(input_file):
         print(f"Error: {input_file} not found")
         return
 
-    with open(input_file, 'rb') as f:
-        data = bytearray(f.read())
+    # 在输出副本上原地修改 (mmap)
+    with instrument.stage('load'):
+        image = FlashImage.clone(input_file, output_file)
+    data = image.buf
 
     print("正在构建‘特洛伊木马’环境变量包...")
 
     # 1. 搬运 DTB 到 0xD1000
-    dtb_data = data[DTB_SOURCE : DTB_SOURCE + DTB_SIZE]
-    if dtb_data[0:4] != b'\xd0\x0d\xfe\xed':
-        print("Warning: DTB Magic check failed, but proceeding...")
-    
-    # 清空 D1000-D5000 区域并写入 DTB
-    data[DTB_TARGET : KERNEL_START] = b'\x00' * (KERNEL_START - DTB_TARGET)
-    data[DTB_TARGET : DTB_TARGET + DTB_SIZE] = dtb_data
+    fdts = locate_components(data, env=False, kinds=('fdt',))
+    dtb = find_component(fdts, 'fdt', at=DTB_SOURCE) or find_component(fdts, 'fdt')
+    if dtb is None:
+        print("Error: DTB not found")
+        image.close()
+        os.remove(output_file)
+        return
+    if dtb.offset != DTB_SOURCE:
+        print(f"Warning: DTB not at {hex(DTB_SOURCE)}, using {hex(dtb.offset)}")
+    DTB_SIZE = dtb.length
+    if DTB_TARGET + DTB_SIZE > KERNEL_START:
+        print("Error: DTB too big for 0xD1000-0xD5000!")
+        image.close()
+        os.remove(output_file)
+        return
+    # 源和目的都在同一个映射里，先取出这几 KB 再清空目标区
+    dtb_data = bytes(data[dtb.offset : dtb.offset + DTB_SIZE])
+
+    # 清空 D1000-D5000 区域并写入 DTB：这里原来是 64KB ENV 的后半段 (文本/填充)，
+    # 盖掉是预期的；如果是代码或压缩数据 (内核提前了之类) 才提醒
+    warn_overwrites(data, [(DTB_TARGET, KERNEL_START - DTB_TARGET, 'DTB')], expect=(LOW_ENTROPY, DATA))
+    with instrument.stage('dtb transplant'):
+        image.fill(DTB_TARGET, KERNEL_START - DTB_TARGET, 0x00)
+        image.write(DTB_TARGET, dtb_data)
     print(f"DTB 已就位: {hex(DTB_TARGET)}")
 
     # 2. 构造环境变量 (放在 D0000 开头)
+    # sf read 只读组件头里的真实长度
+    sizes = boot_sizes(data)
+    report_saving(sizes)
     env_dict = {
         b'key': MY_KEY.encode('ascii'),
         b'ethaddr': MY_MAC.encode('ascii'),
@@ -48,43 +78,53 @@ def magic_fix_firmware():
         b'image_name': b'Image',
         b'initrd_image': b'uInitrd',
         # 启动命令 (含 lzmadec)
-        b'bootcmd': b'run syno_bootargs; sf probe; sf read 0x1000000 0x0D5000 0x306000; lzmadec 0x1000000 0x2000000; sf read 0x3000000 0x3DB000 0x410000; sf read 0x1000000 0xD1000 0x4000; i2c mw 0x45 0x33 0x72; i2c mw 0x45 0x3d 0x66; i2c mw 0x45 0x3e 0x66; i2c mw 0x45 0x34 0x00; i2c mw 0x45 0x36 0xff; booti 0x2000000 0x3000000 0x1000000',
+        b'bootcmd': ('run syno_bootargs; ' + sf_reads(sizes) + 'i2c mw 0x45 0x33 0x72; i2c mw 0x45 0x3d 0x66; i2c mw 0x45 0x3e 0x66; i2c mw 0x45 0x34 0x00; i2c mw 0x45 0x36 0xff; booti 0x2000000 0x3000000 0x1000000').encode('ascii'),
         # 群晖参数
         b'syno_bootargs': b'setenv bootargs console=ttyS0,115200 ip=off initrd=0x3000000 root=/dev/sda1 rw syno_usb_vbus_gpio=36@d0058000.usb3@1@0,37@d005e000.usb@1@0 syno_castrated_xhc=d0058000.usb3@1 swiotlb=2048 syno_hw_version=DS120j syno_fw_version=M.301 syno_hdd_powerup_seq=1 ihd_num=1 netif_num=1 syno_hdd_enable=40 syno_hdd_act_led=10 flash_size=8',
     }
 
-    env_payload = bytearray()
-    for k, v in env_dict.items():
-        env_payload += k + b'=' + v + b'\0'
-    env_payload += b'\0' # 双 Null 结束符，告诉 U-Boot 变量到此为止
+    env_payload = payload(env_dict) # 以双 Null 结束，告诉 U-Boot 变量到此为止
 
     # 写入环境变量到头部 (保留 CRC 占位符)
     payload_len = len(env_payload)
     if payload_len > (DTB_TARGET - ENV_START - 4):
         print("Error: Env vars too big!")
+        image.close()
+        os.remove(output_file)
         return
     
-    # 填入数据
-    data[ENV_START + 4 : ENV_START + 4 + payload_len] = env_payload
-    
-    # 填充 0x00 直到 DTB 开始 (清理旧数据)
-    data[ENV_START + 4 + payload_len : DTB_TARGET] = b'\x00' * (DTB_TARGET - (ENV_START + 4 + payload_len))
+    with instrument.stage('env build'):
+        # 填入数据
+        image.write(ENV_START + 4, env_payload)
+
+        # 填充 0x00 直到 DTB 开始 (清理旧数据)
+        image.fill(ENV_START + 4 + payload_len, DTB_TARGET - (ENV_START + 4 + payload_len), 0x00)
 
     # 3. 计算“全局” CRC (覆盖 D0000 到 E0000，包含内核!)
     # 这是骗过 U-Boot 的核心：把内核当做环境变量的一部分来计算校验和
-    full_env_block = data[ENV_START + 4 : ENV_END]
     print(f"正在计算 64KB 区块 CRC (包含内核数据)...")
-    crc = binascii.crc32(full_env_block) & 0xFFFFFFFF
+    with instrument.stage('crc', read=ENV_END - ENV_START - 4):
+        crc = binascii.crc32(data[ENV_START + 4 : ENV_END]) & 0xFFFFFFFF
     
     # 4. 写入 CRC 头
     data[ENV_START : ENV_START + 4] = struct.pack('<I', crc)
 
-    with open(output_file, 'wb') as f:
-        f.write(data)
+    # 5. 检查内核/DTB/Ramdisk 能否正常加载
+    ok = validate_boot_image(data)
+    image.close()
+    if not ok:
+        os.remove(output_file)
+        print(f"Error: 校验失败，{output_file} 已删除")
+        return
     
     print(f"生成完毕: {output_file}")
     print(f"CRC32: {hex(crc)} (已包含内核指纹)")
     print("注意：刷入后千万不要执行 'saveenv'，否则会擦除内核！")
+    if delta:
+        # 只改了 ENV + DTB 这 20KB (0xD0000-0xD5000)
+        emit_delta(input_file, output_file, [(ENV_START, KERNEL_START - ENV_START)])
 
 if __name__ == "__main__":
-    magic_fix_firmware()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--delta', action='store_true', help='只输出相对 623.8.1.bin 的增量补丁')
+    magic_fix_firmware(parser.parse_args().delta)
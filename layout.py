@@ -0,0 +1,285 @@
+import os
+import sys
+import json
+import argparse
+import instrument
+from collections import namedtuple
+from image_io import FlashImage
+from locate import locate_components, find_component
+from bootcmd import boot_sizes, sf_reads, report_saving
+from validate import validate_boot_image
+from fdt import Fdt, set_string, set_u32s, write_back
+from uboot_env import serialize
+
+# 布局描述文件 (JSON) 所在目录：新变体只需要加一个配置文件
+LAYOUTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'layouts')
+
+# 写入计划的一步：按 offset 排序后顺序执行
+#   op = 'copy' (从 source 的 src_offset 复制) / 'fill' (填充 value) / 'env' (保留给环境变量)
+Step = namedtuple('Step', 'offset length op name source src_offset value')
+
+
+def parse_int(v):
+    """布局里的数字可以写成 "0xD5000" 这样的字符串，也可以直接是整数"""
+    return int(v, 0) if isinstance(v, str) else v
+
+
+def load_layout(name_or_path):
+    """按名字 (layouts/<name>.json) 或路径读取布局描述"""
+    path = name_or_path
+    if not os.path.exists(path):
+        path = os.path.join(LAYOUTS_DIR, f'{name_or_path}.json')
+    with open(path) as f:
+        return json.load(f)
+
+
+def _flash_offset(value, placed):
+    # "at" 可以是数字，也可以是 "<区域名>.end" (紧跟在某个区域之后)
+    if isinstance(value, str) and value.endswith('.end'):
+        ref = value[:-4]
+        if ref not in placed:
+            raise ValueError(f"区域 {ref} 还没有定义，不能引用 {value}")
+        step = placed[ref]
+        return step.offset + step.length
+    return parse_int(value)
+
+
+def _resolve(region, placed, sources, components, size):
+    name = region['name']
+    offset = _flash_offset(region['at'], placed)
+    end = parse_int(region['end']) if 'end' in region else None
+
+    if 'fill' in region:
+        length = parse_int(region['length']) if 'length' in region else (end if end is not None else size) - offset
+        return Step(offset, length, 'fill', name, None, None, parse_int(region['fill'])), None
+
+    if region.get('env'):
+        return Step(offset, parse_int(region['length']), 'env', name, None, None, None), None
+
+    src_name = region['source']
+    if src_name not in sources:
+        raise ValueError(f"区域 {name} 需要源镜像 {src_name}，但没有给出")
+    src = sources[src_name]
+
+    if 'component' in region:
+        # 组件的位置和长度都从源镜像的头部得到
+        kind = region['component']
+        if src_name not in components:
+            components[src_name] = locate_components(src.buf, env=False)
+        comps = components[src_name]
+        start = 0
+        if 'after' in region:
+            prev = placed[region['after']]
+            start = prev.src_offset + prev.length
+        comp = None
+        if 'near' in region:
+            comp = find_component(comps, kind, at=parse_int(region['near']))
+            if comp is None:
+                print(f"Warning: {src_name} 的 {hex(parse_int(region['near']))} 处没有 {kind}，改用扫描到的第一个")
+        comp = comp or find_component(comps, kind, start=start)
+        if comp is None:
+            raise ValueError(f"{src_name} 中找不到区域 {name} 需要的 {kind}")
+        src_offset, length = comp.offset, comp.length
+        info = comp
+    else:
+        src_offset = parse_int(region.get('from', 0))
+        length = region.get('length', 'eof')
+        length = src.size - src_offset if length == 'eof' else parse_int(length)
+        info = None
+
+    if src_offset + length > src.size:
+        raise ValueError(f"区域 {name} 超出源镜像 {src_name} 末尾")
+    if end is not None and offset + length > end:
+        raise ValueError(f"区域 {name} 有 {length} 字节，放不进 {hex(offset)}-{hex(end)}")
+    return Step(offset, length, 'copy', name, src_name, src_offset, None), info
+
+
+def build_plan(layout, sources):
+    """把布局描述编译成按偏移排序、互不重叠的写入计划。
+
+    sources 是 {源名字: FlashImage}。越界、重叠 (特别是 ENV 被 DTB 等区域
+    压到) 在这里就报 ValueError，不会等到生成镜像之后才发现。
+    """
+    with instrument.stage('plan'):
+        return _build_plan(layout, sources)
+
+
+def _build_plan(layout, sources):
+    size = parse_int(layout.get('size', len(sources) and next(iter(sources.values())).size))
+    placed, found, components = {}, {}, {}
+    for region in layout['regions']:
+        step, comp = _resolve(region, placed, sources, components, size)
+        if step.name in placed:
+            raise ValueError(f"区域名重复: {step.name}")
+        if step.offset < 0 or step.offset + step.length > size:
+            raise ValueError(f"区域 {step.name} ({hex(step.offset)}+{hex(step.length)}) 超出镜像大小 {hex(size)}")
+        placed[step.name] = step
+        found[step.name] = comp
+
+    steps = sorted((s for s in placed.values() if s.length > 0), key=lambda s: s.offset)
+    for a, b in zip(steps, steps[1:]):
+        if a.offset + a.length > b.offset:
+            kind = "ENV 冲突" if 'env' in (a.op, b.op) else "区域重叠"
+            raise ValueError(f"{kind}: {a.name} [{hex(a.offset)}, {hex(a.offset + a.length)}) "
+                             f"与 {b.name} [{hex(b.offset)}, {hex(b.offset + b.length)})")
+
+    # 空隙按 layout 的 fill 补齐 (0x00 不用写，新文件本来就是空洞)
+    fill = parse_int(layout.get('fill', 0))
+    if fill != 0x00:
+        pos, gaps = 0, []
+        for s in steps + [Step(size, 0, 'fill', None, None, None, None)]:
+            if s.offset > pos:
+                gaps.append(Step(pos, s.offset - pos, 'fill', '(gap)', None, None, fill))
+            pos = max(pos, s.offset + s.length)
+        steps = sorted(steps + gaps, key=lambda s: s.offset)
+    return {'size': size, 'steps': steps, 'regions': placed, 'components': found}
+
+
+def print_plan(plan):
+    print(f"{'Offset':<10} {'End':<10} {'Op':<5} {'Region':<10} Source")
+    print("-" * 60)
+    for s in plan['steps']:
+        src = f"{s.source}@{hex(s.src_offset)}" if s.op == 'copy' else \
+            (f"0x{s.value:02X}" if s.op == 'fill' else '')
+        print(f"{hex(s.offset):<10} {hex(s.offset + s.length):<10} {s.op:<5} {s.name:<10} {src}")
+
+
+def execute_plan(plan, sources, out_path):
+    """按偏移顺序一遍写完输出镜像，返回可写的 FlashImage (ENV 区域留给调用方)"""
+    with instrument.stage('transplant'):
+        out = FlashImage.create(out_path, plan['size'])
+        try:
+            for s in plan['steps']:
+                if s.op == 'copy':
+                    out.copy_from(sources[s.source], s.src_offset, s.offset, s.length)
+                elif s.op == 'fill' and s.value != 0x00:
+                    out.fill(s.offset, s.length, s.value)
+        except BaseException:
+            out.close()
+            os.remove(out_path)
+            raise
+    return out
+
+
+def apply_fdt_edits(out, layout, plan):
+    """区域里的 "fdt": {节点路径: {属性: 字符串或 u32 列表}} 直接改输出镜像里的设备树；
+    值变长需要重新打包时，不能超过区域的 end"""
+    for region in layout['regions']:
+        if not region.get('fdt'):
+            continue
+        step = plan['regions'][region['name']]
+        limit = parse_int(region['end']) if 'end' in region else step.offset + step.length
+        with instrument.stage('fdt edit'):
+            fdt = Fdt(out.buf, step.offset)
+            for path, props in region['fdt'].items():
+                for name, value in props.items():
+                    if isinstance(value, str):
+                        set_string(fdt, path, name, value)
+                    else:
+                        set_u32s(fdt, path, name, [parse_int(v) for v in value])
+            write_back(out, step.offset, fdt, limit)
+        print(f"  [FDT] {region['name']} @ {hex(step.offset)}: "
+              f"{sum(len(p) for p in region['fdt'].values())} 个属性" + (" (已重新打包)" if fdt.repacked else ""))
+
+
+def render_env(env_vars, size, sizes=None, offsets=None):
+    """layout 里的环境变量 -> 带 CRC 的 ENV 块；bootcmd 里的 {sf_reads} 换成实际读取命令。
+
+    offsets 为 boot_offsets 给出的 (kernel, ramdisk, dtb)，不给时用 bootcmd 的默认位置。
+    """
+    if sizes is not None:
+        reads = sf_reads(sizes, *(offsets or ()))
+        env_vars = {k: v.replace('{sf_reads}', reads) for k, v in env_vars.items()}
+    return serialize(env_vars, size)
+
+
+def boot_offsets(layout, plan):
+    """layout 的 boot 段给出 bootcmd 读取的位置 (数字或区域名)，返回 (kernel, ramdisk, dtb)"""
+    boot = layout['boot']
+
+    def where(v):
+        return plan['regions'][v].offset if v in plan['regions'] else parse_int(v)
+    return where(boot['kernel']), where(boot['ramdisk']), where(boot['dtb'])
+
+
+def build_from_layout(layout, source_paths, out_path=None, env_overrides=None):
+    """按布局生成镜像：编译计划 -> 一遍写入 -> 填 ENV -> 校验。成功返回输出路径"""
+    out_path = out_path or layout['output']
+    for path in source_paths.values():
+        if not os.path.exists(path):
+            print(f"Error: 找不到 {path}")
+            return None
+    with instrument.stage('load'):
+        sources = {name: FlashImage.open(path) for name, path in source_paths.items()}
+    try:
+        try:
+            plan = build_plan(layout, sources)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return None
+        print_plan(plan)
+        out = execute_plan(plan, sources, out_path)
+    finally:
+        for src in sources.values():
+            src.close()
+    try:
+        apply_fdt_edits(out, layout, plan)
+    except ValueError as e:
+        out.close()
+        os.remove(out_path)
+        print(f"Error: {e}")
+        return None
+
+    kernel, ramdisk, dtb = boot_offsets(layout, plan)
+    for region in layout['regions']:
+        if not region.get('env'):
+            continue
+        step = plan['regions'][region['name']]
+        with instrument.stage('env build'):
+            sizes = boot_sizes(out.buf, kernel, ramdisk, dtb)
+            report_saving(sizes)
+            env_vars = dict(region['env'], **(env_overrides or {}))
+            block, crc = render_env(env_vars, step.length, sizes, (kernel, ramdisk, dtb))
+            out.write(step.offset, block)
+        print(f"  [ENV] {region['name']} @ {hex(step.offset)}, CRC {hex(crc)}")
+
+    ok = validate_boot_image(out.buf, kernel, ramdisk, dtb)
+    out.close()
+    if not ok:
+        os.remove(out_path)
+        print(f"\n❌ 校验失败，{out_path} 已删除！")
+        return None
+    return out_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='按布局描述文件合成固件')
+    parser.add_argument('layout', help='layouts/ 下的名字或 JSON 路径')
+    parser.add_argument('--source', action='append', default=[], metavar='NAME=PATH',
+                        help='覆盖布局里的源镜像路径')
+    parser.add_argument('-o', '--output')
+    parser.add_argument('--plan', action='store_true', help='只打印写入计划，不生成镜像')
+    parser.add_argument('--trace', help='把各阶段耗时/字节数写到这个 JSON 文件')
+    args = parser.parse_args()
+    if args.trace:
+        instrument.enable(args.trace)
+
+    layout = load_layout(args.layout)
+    source_paths = dict(layout['sources'])
+    for item in args.source:
+        name, _, path = item.partition('=')
+        source_paths[name] = path
+
+    if args.plan:
+        sources = {name: FlashImage.open(path) for name, path in source_paths.items()}
+        try:
+            print_plan(build_plan(layout, sources))
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        sys.exit(0)
+
+    out = build_from_layout(layout, source_paths, args.output)
+    if out is None:
+        sys.exit(1)
+    print(f"\n成功！{out} 已按 {layout['name']} 布局生成。")
@@ -0,0 +1,253 @@
+import re
+import sys
+import lzma
+import zlib
+import struct
+import binascii
+from collections import namedtuple
+import instrument
+
+# 固件里所有组件的定位表：(类型, 起始偏移, 真实长度, 头部信息)
+Component = namedtuple('Component', 'kind offset length info')
+
+MAGIC_FDT = b'\xd0\x0d\xfe\xed'
+MAGIC_UIMAGE = b'\x27\x05\x19\x56'
+MAGIC_LZMA = b'\x5d\x00\x00'
+MAGIC_GZIP = b'\x1f\x8b\x08'
+MAGIC_SQUASHFS = b'hsqs'
+
+# 一个正则把所有魔数串起来，整个镜像只线性扫一遍
+_SIGNATURES = re.compile(b'|'.join(re.escape(m) for m in (
+    MAGIC_FDT, MAGIC_UIMAGE, MAGIC_LZMA, MAGIC_GZIP, MAGIC_SQUASHFS)))
+
+# U-Boot 环境变量：扇区对齐，CRC 之后就是 "name=value"
+ENV_ALIGN = 0x1000
+ENV_SIZES = (0x1000, 0x2000, 0x4000, 0x8000, 0x10000)
+_ENV_TEXT = re.compile(rb'[A-Za-z_][A-Za-z0-9_.]{0,31}=[\x20-\x7e]')
+
+UIMAGE_HEADER_SIZE = 64
+# 解压测长时每次最多产出这么多，内存不随内核大小增长
+_STREAM_CHUNK = 0x10000
+_STREAM_OUT = 0x100000
+
+
+def lzma_stream(mv, offset, limit=None):
+    """流式解压 offset 处的 LZMA-alone 数据，输出直接丢弃，内存占用恒定。
+
+    返回 (压缩长度, 解压后长度)；数据损坏、没有结束、或解压输出超过 limit
+    时立即停止并抛出 ValueError。
+    """
+    if offset + 13 > len(mv):
+        raise ValueError("LZMA 头不完整")
+    props = mv[offset]
+    dict_size, out_size = struct.unpack_from('<IQ', mv, offset + 1)
+    if props >= 9 * 5 * 5 or dict_size < 0x1000 or dict_size > 0x8000000:
+        raise ValueError(f"LZMA 头参数异常 (props={props:#x}, dict={dict_size:#x})")
+    if out_size != 0xFFFFFFFFFFFFFFFF:
+        if out_size > 0x10000000:
+            raise ValueError(f"LZMA 头声明的解压大小异常: {out_size:#x}")
+        if limit is not None and out_size > limit:
+            raise ValueError(f"解压后 {out_size:#x} 字节，超出限制 {limit:#x}")
+    d = lzma.LZMADecompressor(format=lzma.FORMAT_ALONE)
+    pos, total = offset, 0
+    try:
+        while not d.eof:
+            if d.needs_input:
+                if pos >= len(mv):
+                    raise ValueError(f"LZMA 数据在 {hex(pos)} 处意外结束")
+                chunk = mv[pos:pos + _STREAM_CHUNK]
+                pos += len(chunk)
+            else:
+                chunk = b''
+            total += len(d.decompress(chunk, max_length=_STREAM_OUT))
+            if limit is not None and total > limit:
+                raise ValueError(f"解压输出已超过限制 {limit:#x}")
+    except lzma.LZMAError as e:
+        raise ValueError(f"LZMA 数据损坏 (约在 {hex(pos)} 之前): {e}")
+    return pos - offset - len(d.unused_data), total
+
+
+def _lzma_length(mv, offset):
+    # LZMA-alone 头里没有压缩后长度，只能流式解压到结束标记
+    try:
+        length, total = lzma_stream(mv, offset)
+    except ValueError:
+        return None
+    dict_size, = struct.unpack_from('<I', mv, offset + 1)
+    return length, {'uncompressed': total, 'dict_size': dict_size}
+
+
+def gzip_stream(mv, start, end=None, limit=None):
+    """流式解压 start 处的 gzip 数据 (不超过 end)，和 lzma_stream 一样边解压边丢弃。
+
+    返回 (压缩长度, 解压后长度)；数据损坏、没有结束或输出超过 limit 时抛出 ValueError。
+    """
+    end = len(mv) if end is None else end
+    d = zlib.decompressobj(31)
+    pos, total, pending = start, 0, b''
+    try:
+        while not d.eof:
+            if not pending:
+                if pos >= end:
+                    raise ValueError(f"gzip 数据在 {hex(pos)} 处意外结束")
+                pending = mv[pos:min(pos + _STREAM_CHUNK, end)]
+                pos += len(pending)
+            total += len(d.decompress(pending, _STREAM_OUT))
+            pending = d.unconsumed_tail
+            if limit is not None and total > limit:
+                raise ValueError(f"解压输出已超过限制 {limit:#x}")
+    except zlib.error as e:
+        raise ValueError(f"gzip 数据损坏 (约在 {hex(pos)} 之前): {e}")
+    return pos - start - len(d.unused_data), total
+
+
+def _gzip_length(mv, offset):
+    if mv[offset + 3] & 0xE0:
+        return None
+    try:
+        length, total = gzip_stream(mv, offset)
+    except ValueError:
+        return None
+    return length, {'uncompressed': total}
+
+
+def _fdt_length(mv, offset):
+    if offset + 40 > len(mv):
+        return None
+    totalsize, off_struct, off_strings, _, version, last_comp = struct.unpack_from('>6I', mv, offset + 4)
+    if not 40 <= totalsize <= len(mv) - offset or version < 16 or last_comp > 17:
+        return None
+    if off_struct >= totalsize or off_strings > totalsize:
+        return None
+    return totalsize, {'version': version}
+
+
+def _uimage_length(mv, offset):
+    if offset + UIMAGE_HEADER_SIZE > len(mv):
+        return None
+    header = bytearray(mv[offset:offset + UIMAGE_HEADER_SIZE])
+    hcrc, = struct.unpack_from('>I', header, 4)
+    header[4:8] = b'\0\0\0\0'
+    if binascii.crc32(header) & 0xFFFFFFFF != hcrc:
+        return None
+    size, load, ep, dcrc, os_, arch, type_, comp = struct.unpack_from('>IIII4B', header, 12)
+    name = bytes(header[32:64]).split(b'\0', 1)[0].decode('ascii', 'replace')
+    return UIMAGE_HEADER_SIZE + size, {'name': name, 'load': load, 'ep': ep, 'dcrc': dcrc,
+                                       'type': type_, 'comp': comp}
+
+
+def _squashfs_length(mv, offset):
+    if offset + 96 > len(mv):
+        return None
+    major, = struct.unpack_from('<H', mv, offset + 28)
+    bytes_used, = struct.unpack_from('<Q', mv, offset + 40)
+    if major != 4 or not 96 <= bytes_used <= len(mv) - offset:
+        return None
+    return bytes_used, {}
+
+
+_PARSERS = {
+    MAGIC_FDT: ('fdt', _fdt_length),
+    MAGIC_UIMAGE: ('uimage', _uimage_length),
+    MAGIC_LZMA: ('lzma', _lzma_length),
+    MAGIC_GZIP: ('gzip', _gzip_length),
+    MAGIC_SQUASHFS: ('squashfs', _squashfs_length),
+}
+
+
+def find_env_blocks(data, sizes=ENV_SIZES):
+    """扇区对齐处找 CRC 能对上的 U-Boot 环境变量块 (单份和带 flags 字节的冗余格式)"""
+    mv = memoryview(data)
+    found = []
+    for off in range(0, len(mv) - 8, ENV_ALIGN):
+        for redundant, text in ((False, off + 4), (True, off + 5)):
+            if not _ENV_TEXT.match(mv[text:text + 40]):
+                continue
+            crc, = struct.unpack_from('<I', mv, off)
+            for size in sizes:
+                if off + size > len(mv):
+                    break
+                if binascii.crc32(mv[text:off + size]) & 0xFFFFFFFF == crc:
+                    found.append(Component('env', off, size, {'crc': crc, 'redundant': redundant}))
+                    break
+            break
+    return found
+
+
+def locate_components(data, env=True, kinds=None):
+    """一次扫描找出镜像里所有已知组件，返回按偏移排序的 Component 列表。
+
+    长度都来自各自的头部 (FDT totalsize / uImage ih_size / squashfs bytes_used)，
+    LZMA 和 gzip 头里没有压缩长度，流式解压到结尾得到。落在已识别组件内部的
+    魔数 (比如 uImage 里包着的 LZMA) 会被跳过。kinds 可以只要部分类型，
+    省掉不需要的解压测长。
+    """
+    with instrument.stage('locate', read=len(data)):
+        return _locate_components(data, env, kinds)
+
+
+def _locate_components(data, env, kinds):
+    mv = memoryview(data)
+    components = []
+    covered = 0
+    for m in _SIGNATURES.finditer(mv):
+        offset = m.start()
+        if offset < covered:
+            continue
+        kind, parse = _PARSERS[m.group()]
+        if kinds is not None and kind not in kinds:
+            continue
+        result = parse(mv, offset)
+        if result is None:
+            continue
+        length, info = result
+        components.append(Component(kind, offset, length, info))
+        covered = offset + length
+    if env:
+        components += find_env_blocks(data)
+        components.sort(key=lambda c: c.offset)
+    return components
+
+
+def component_at(data, offset, kind):
+    """已知位置和类型时直接解析这一个头，不扫描整个镜像"""
+    mv = memoryview(data)
+    for magic, (name, parse) in _PARSERS.items():
+        if name != kind:
+            continue
+        if mv[offset:offset + len(magic)] != magic:
+            return None
+        result = parse(mv, offset)
+        if result is None:
+            return None
+        length, info = result
+        return Component(kind, offset, length, info)
+    raise ValueError(f"未知组件类型: {kind}")
+
+
+def find_component(components, kind, at=None, start=0):
+    """按类型取组件：at 给定时要求起始偏移正好是 at，否则取 start 之后第一个"""
+    for c in components:
+        if c.kind != kind:
+            continue
+        if at is not None:
+            if c.offset == at:
+                return c
+        elif c.offset >= start:
+            return c
+    return None
+
+
+def print_components(components):
+    print(f"{'Type':<10} {'Offset':<10} {'Length':<10} Info")
+    print("-" * 60)
+    for c in components:
+        print(f"{c.kind:<10} {hex(c.offset):<10} {hex(c.length):<10} {c.info}")
+
+
+if __name__ == "__main__":
+    for filename in sys.argv[1:] or ['623.8.1.bin']:
+        with open(filename, 'rb') as f:
+            data = f.read()
+        print(f">>> {filename}")
+        print_components(locate_components(data))
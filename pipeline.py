@@ -0,0 +1,121 @@
+import os
+import sys
+import time
+import argparse
+import instrument
+from image_io import FlashImage
+from layout import load_layout, build_plan, execute_plan, apply_fdt_edits, boot_offsets, parse_int
+from bootcmd import boot_sizes, report_saving
+from validate import validate_boot_image
+from uboot_env import serialize
+from custom_identity import VENDOR_SIZE, patch_vendor, build_env_vars
+
+# 一条命令从 old.bin + 623.8.1.bin 直接得到 hybrid_v8_final.bin：
+# hybrid_ultimate.py 和 custom_identity.py 的步骤都在同一个输出映射上完成，
+# 不再落地 8MB 的 hybrid_ultimate.bin 再读回来。
+
+
+def stage_hybridize(ctx):
+    """按布局一遍写出 U-Boot/DTB/内核 (ENV 区域留到后面签名)"""
+    layout = load_layout(ctx['layout'])
+    env = [r for r in layout['regions'] if r.get('env')]
+    if not env or 'vendor' not in layout:
+        raise ValueError(f"布局 {layout['name']} 没有 ENV 区域或 vendor 位置，不能写入身份信息")
+    paths = dict(layout['sources'], **ctx['sources'])
+    sources = {name: FlashImage.open(path) for name, path in paths.items()}
+    try:
+        plan = build_plan(layout, sources)
+        ctx['image'] = execute_plan(plan, sources, ctx['output'])
+    finally:
+        for src in sources.values():
+            src.close()
+    apply_fdt_edits(ctx['image'], layout, plan)
+    # 后面几个阶段都按布局里的位置读写，不用 custom_identity 的固定偏移
+    ctx['env'] = plan['regions'][env[0]['name']]
+    ctx['vendor'] = parse_int(layout['vendor'])
+    ctx['boot'] = boot_offsets(layout, plan)
+
+
+def stage_identity(ctx):
+    """Vendor 区写入 MAC 和 SN"""
+    data = ctx['image'].buf
+    patch_vendor(data[ctx['vendor']:ctx['vendor'] + VENDOR_SIZE], ctx['mac'], ctx['sn'])
+
+
+def stage_env(ctx):
+    """按组件头的真实长度生成 bootcmd，重新签名布局里的 ENV 区域"""
+    data = ctx['image'].buf
+    sizes = boot_sizes(data, *ctx['boot'])
+    report_saving(sizes)
+    env = ctx['env']
+    block, crc = serialize(build_env_vars(ctx['mac'], sizes, ctx['boot']), env.length)
+    data[env.offset:env.offset + env.length] = block
+    print(f"  [CRC Fix] ENV @ {hex(env.offset)} ({env.length // 1024}KB) CRC: {hex(crc)}")
+
+
+def stage_validate(ctx):
+    if not validate_boot_image(ctx['image'].buf, *ctx['boot']):
+        raise ValueError("内核/DTB/Ramdisk 校验失败")
+
+
+STAGES = [
+    ('hybridize', stage_hybridize),
+    ('identity', stage_identity),
+    ('env', stage_env),
+    ('validate', stage_validate),
+]
+
+
+def run_pipeline(mac, sn, output='hybrid_v8_final.bin', sources=None, layout='hybrid'):
+    """依次执行各阶段，返回 [(阶段, 秒)]；任一阶段失败时删除输出并返回 None"""
+    ctx = {'mac': mac, 'sn': sn, 'output': output, 'sources': sources or {}, 'layout': layout}
+    timings = []
+    ok = False
+    try:
+        for name, stage in STAGES:
+            start = time.perf_counter()
+            with instrument.stage(name):
+                stage(ctx)
+            timings.append((name, time.perf_counter() - start))
+        ok = True
+    except (ValueError, OSError) as e:
+        print(f"Error: [{name}] {e}")
+    finally:
+        # 其它异常照样往外抛，但不留下写了一半的 8MB 输出
+        if 'image' in ctx:
+            ctx['image'].close()
+            if not ok:
+                os.remove(output)
+    return timings if ok else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='old.bin + 623 -> 定制身份的最终固件，一步完成')
+    parser.add_argument('--mac', default="00:11:32:A3:67:EF")
+    parser.add_argument('--sn', default="1910Q2N321313")
+    parser.add_argument('--old', help='提供 U-Boot 的镜像 (默认见 layouts/hybrid.json)')
+    parser.add_argument('--firmware', help='提供 DTB/内核的 623 镜像')
+    parser.add_argument('--layout', default='hybrid', help='布局里要有 ENV 区域和 vendor 位置 (默认 hybrid)')
+    parser.add_argument('-o', '--output', default='hybrid_v8_final.bin')
+    parser.add_argument('--trace', help='把各阶段耗时/字节数写到这个 JSON 文件')
+    args = parser.parse_args()
+    if args.trace:
+        instrument.enable(args.trace)
+
+    sources = {}
+    if args.old:
+        sources['uboot'] = args.old
+    if args.firmware:
+        sources['firmware'] = args.firmware
+
+    print(f"正在生成 {args.output} (MAC {args.mac}, SN {args.sn})...")
+    timings = run_pipeline(args.mac, args.sn, args.output, sources, args.layout)
+    if timings is None:
+        print(f"\n❌ 生成失败！")
+        sys.exit(1)
+
+    print()
+    for name, seconds in timings:
+        print(f"  {name:<10} {seconds * 1000:8.1f}ms")
+    print(f"  {'total':<10} {sum(s for _, s in timings) * 1000:8.1f}ms")
+    print(f"\n成功！{args.output} 已生成。")
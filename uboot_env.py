@@ -0,0 +1,190 @@
+import sys
+import json
+import struct
+import binascii
+import argparse
+from collections import namedtuple
+from image_io import FlashImage
+from crc_util import crc32_combine, crc32_zeros, zero_extender
+from locate import ENV_SIZES, find_env_blocks
+
+# U-Boot 环境变量块的编解码：
+#   单份格式  crc32(LE) + 数据
+#   冗余格式  crc32(LE) + flags (1 字节) + 数据   (CONFIG_ENV_OFFSET_REDUND，两份轮流写)
+# 数据 = "k=v\0" ... "\0"，其余填充到块大小；CRC 只覆盖数据部分 (不含 flags)。
+ENV_PAD = 0x00
+ACTIVE_FLAG = 0x01
+
+# 解析结果：vars 保持原来的顺序
+EnvBlock = namedtuple('EnvBlock', 'vars crc crc_ok redundant flags size')
+
+
+def _b(v):
+    return v.encode('ascii') if isinstance(v, str) else bytes(v)
+
+
+def header_size(redundant=False):
+    return 5 if redundant else 4
+
+
+def payload(env_vars):
+    """{k: v} -> b'k=v\\0...\\0' (不填充)，键/值可以是 str 或 bytes"""
+    return b''.join(_b(k) + b'=' + _b(v) + b'\0' for k, v in env_vars.items()) + b'\0'
+
+
+def serialize(env_vars, size, redundant=False, flags=ACTIVE_FLAG, pad=ENV_PAD):
+    """生成整个 size 字节的 ENV 块，返回 (块, crc)；放不下时抛 ValueError"""
+    data = payload(env_vars)
+    room = size - header_size(redundant)
+    if len(data) > room:
+        raise ValueError(f"环境变量 {len(data)} 字节，超过 ENV 大小 {hex(size)}")
+    data = data.ljust(room, bytes([pad]))
+    crc = binascii.crc32(data) & 0xFFFFFFFF
+    head = struct.pack('<I', crc) + (bytes([flags]) if redundant else b'')
+    return head + data, crc
+
+
+def parse(block, redundant=None):
+    """解析 ENV 块。redundant=None 时按 CRC 自动判断格式；CRC 都对不上时按单份格式解析"""
+    mv = memoryview(block)
+    crc, = struct.unpack_from('<I', mv)
+    if redundant is None:
+        redundant = binascii.crc32(mv[4:]) & 0xFFFFFFFF != crc and \
+            binascii.crc32(mv[5:]) & 0xFFFFFFFF == crc
+    start = header_size(redundant)
+    env_vars = {}
+    pos = start
+    while pos < len(mv) and mv[pos]:
+        end = bytes(mv[pos:]).find(b'\0')
+        end = len(mv) if end < 0 else pos + end
+        key, sep, value = bytes(mv[pos:end]).partition(b'=')
+        if sep:
+            env_vars[key.decode('ascii', 'replace')] = value.decode('ascii', 'replace')
+        pos = end + 1
+    crc_ok = binascii.crc32(mv[start:]) & 0xFFFFFFFF == crc
+    return EnvBlock(env_vars, crc, crc_ok, redundant, mv[4] if redundant else None, len(mv))
+
+
+def read_env(data, offset=None, size=None, redundant=None):
+    """从镜像里读 ENV：不给 offset/size 时用 locate.find_env_blocks 找第一个 CRC 正确的块"""
+    if offset is None or size is None:
+        blocks = [b for b in find_env_blocks(data, (size,) if size else ENV_SIZES)
+                  if offset is None or b.offset == offset]
+        if not blocks:
+            raise ValueError("镜像里找不到 CRC 正确的环境变量块")
+        offset, size = blocks[0].offset, blocks[0].length
+        redundant = blocks[0].info['redundant']
+    return offset, parse(memoryview(data)[offset:offset + size], redundant)
+
+
+def diff_env(old, new):
+    """[(键, 旧值, 新值)]，不存在的一边为 None；按 old 的顺序，new 新增的排在后面"""
+    keys = list(old) + [k for k in new if k not in old]
+    return [(k, old.get(k), new.get(k)) for k in keys if old.get(k) != new.get(k)]
+
+
+class EnvTemplate:
+    """大量只有少数几个变量不同的 ENV 块 (身份信息、bootcmd 试验)：
+
+    第一个可变变量之前的部分只序列化一次并记下 CRC，之后的固定部分也预先
+    拼好；每个变体只拼接变了的值，CRC 从前缀 CRC 接着算，0x00 填充区的
+    CRC 用查表补上 (长度和模板相同时) 或 crc32_combine，不用每次重建字典、
+    填充、扫整个块。
+    """
+
+    def __init__(self, env_vars, size, vary, redundant=False, flags=ACTIVE_FLAG):
+        missing = [k for k in vary if k not in env_vars]
+        if missing:
+            raise ValueError(f"模板里没有变量 {missing}")
+        self.size = size
+        self.room = size - header_size(redundant)
+        self.flag = bytes([flags]) if redundant else b''
+        self.defaults = {k: _b(v) for k, v in env_vars.items()}
+        # pieces: 固定字节和可变变量名交替，[head, key1, fixed1, key2, fixed2 ...]
+        keys = list(env_vars)
+        first = min(keys.index(k) for k in vary)
+        self.head = payload({k: env_vars[k] for k in keys[:first]})[:-1]
+        self.head_crc = binascii.crc32(self.head)
+        self.pieces = []
+        fixed = b''
+        for k in keys[first:]:
+            if k in vary:
+                if fixed:
+                    self.pieces.append(fixed)
+                self.pieces.append(k)
+                fixed = b''
+            else:
+                fixed += _b(k) + b'=' + _b(env_vars[k]) + b'\0'
+        self.pieces.append(fixed + b'\0')
+        self.prefix = {k: _b(k) + b'=' for k in vary}
+        # 等长变体 (MAC 之类) 的填充长度固定，补零的 CRC 算子预先展开
+        self.pad = self.room - len(payload(env_vars))
+        if self.pad < 0:
+            raise ValueError(f"模板超过 ENV 大小 {hex(size)}")
+        self.extend = zero_extender(self.pad)
+
+    def render(self, **values):
+        """返回 (块, crc)；没给出的可变变量用模板里的值"""
+        parts = [self.head]
+        for piece in self.pieces:
+            if isinstance(piece, str):
+                parts.append(self.prefix[piece] + _b(values.get(piece, self.defaults[piece])) + b'\0')
+            else:
+                parts.append(piece)
+        body = b''.join(parts)
+        pad = self.room - len(body)
+        if pad < 0:
+            raise ValueError(f"环境变量 {len(body)} 字节，超过 ENV 大小 {hex(self.size)}")
+        crc = self.head_crc
+        for part in parts[1:]:
+            crc = binascii.crc32(part, crc)
+        crc = self.extend(crc) if pad == self.pad else crc32_combine(crc, crc32_zeros(pad), pad) & 0xFFFFFFFF
+        return struct.pack('<I', crc) + self.flag + body + bytes(pad), crc
+
+
+def print_env(env):
+    fmt = '冗余 (flags=%d)' % env.flags if env.redundant else '单份'
+    print(f"{fmt}, {hex(env.size)} 字节, CRC {env.crc:#010x} " + ("✅" if env.crc_ok else "❌ 不匹配"))
+    for k, v in env.vars.items():
+        print(f"  {k}={v}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='读取/比较 U-Boot 环境变量块 (单份和冗余格式)')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('show', help='打印镜像里的环境变量')
+    p.add_argument('image')
+    p = sub.add_parser('diff', help='比较两个镜像 (或镜像和 JSON 字典) 的环境变量')
+    p.add_argument('old')
+    p.add_argument('new', help='镜像，或 {"k": "v"} 形式的 JSON 文件')
+    for p in sub.choices.values():
+        p.add_argument('--offset', type=lambda v: int(v, 0), default=None, help='默认自动查找')
+        p.add_argument('--size', type=lambda v: int(v, 0), default=None)
+    args = parser.parse_args()
+
+    def load(path):
+        if path.endswith('.json'):
+            with open(path) as f:
+                return json.load(f)
+        with FlashImage.open(path) as image:
+            offset, env = read_env(image.buf, args.offset, args.size)
+        print(f">>> {path} @ {hex(offset)}: ", end='')
+        print_env(env)
+        return env.vars
+
+    try:
+        if args.cmd == 'show':
+            load(args.image)
+        else:
+            changes = diff_env(load(args.old), load(args.new))
+            print(f"\n=== {len(changes)} 项变化 ===")
+            for key, before, after in changes:
+                if before is None:
+                    print(f"+ {key}={after}")
+                elif after is None:
+                    print(f"- {key}={before}")
+                else:
+                    print(f"~ {key}: {before}\n  -> {after}")
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
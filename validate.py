@@ -0,0 +1,95 @@
+import sys
+import binascii
+import instrument
+from image_io import FlashImage
+from locate import MAGIC_FDT, MAGIC_UIMAGE, MAGIC_LZMA, UIMAGE_HEADER_SIZE, component_at, lzma_stream, gzip_stream
+from bootcmd import FLASH_KERNEL, FLASH_RAMDISK, FLASH_DTB, KERNEL_RAM_WINDOW
+
+# uImage 的压缩类型 (ih_comp)
+IH_COMP_NONE, IH_COMP_GZIP, IH_COMP_LZMA = 0, 1, 3
+
+
+def check_uimage(data, offset, limit=None):
+    """校验 uImage 头 CRC 和数据 CRC；压缩的内核再流式解压一遍确认能解开"""
+    mv = memoryview(data)
+    if mv[offset:offset + 4] != MAGIC_UIMAGE:
+        raise ValueError(f"{hex(offset)} 处不是 uImage")
+    comp = component_at(mv, offset, 'uimage')
+    if comp is None:
+        raise ValueError(f"{hex(offset)} 处 uImage 头 CRC 错误")
+    end = offset + comp.length
+    if end > len(mv):
+        raise ValueError(f"uImage 数据超出镜像末尾 ({hex(end)})")
+    dcrc = binascii.crc32(mv[offset + UIMAGE_HEADER_SIZE:end]) & 0xFFFFFFFF
+    if dcrc != comp.info['dcrc']:
+        raise ValueError(f"uImage '{comp.info['name']}' 数据 CRC 错误 "
+                         f"({dcrc:#010x} != {comp.info['dcrc']:#010x})")
+    msg = f"uImage '{comp.info['name']}' {comp.length} 字节, CRC 正确"
+    if limit is not None:
+        if comp.info['comp'] == IH_COMP_LZMA:
+            _, total = lzma_stream(mv[:end], offset + UIMAGE_HEADER_SIZE, limit)
+        elif comp.info['comp'] == IH_COMP_GZIP:
+            _, total = gzip_stream(mv, offset + UIMAGE_HEADER_SIZE, end, limit)
+        else:
+            total = comp.length - UIMAGE_HEADER_SIZE
+            if total > limit:
+                raise ValueError(f"内核 {total:#x} 字节，超出内存窗口 {limit:#x}")
+        msg += f", 解压后 {total} 字节"
+    return msg
+
+
+def check_kernel(data, offset=FLASH_KERNEL, limit=KERNEL_RAM_WINDOW):
+    """内核必须能完整解压，且解压后放得进 0x2000000 ~ 0x3000000"""
+    mv = memoryview(data)
+    if mv[offset:offset + 4] == MAGIC_UIMAGE:
+        return check_uimage(mv, offset, limit)
+    if mv[offset:offset + len(MAGIC_LZMA)] != MAGIC_LZMA:
+        raise ValueError(f"{hex(offset)} 处既不是 LZMA 也不是 uImage: {bytes(mv[offset:offset + 4]).hex()}")
+    length, total = lzma_stream(mv, offset, limit)
+    return f"LZMA {length} 字节 -> {total} 字节 (上限 {limit:#x})"
+
+
+def check_fdt(data, offset=FLASH_DTB):
+    mv = memoryview(data)
+    if mv[offset:offset + 4] != MAGIC_FDT:
+        raise ValueError(f"{hex(offset)} 处不是设备树: {bytes(mv[offset:offset + 4]).hex()}")
+    comp = component_at(mv, offset, 'fdt')
+    if comp is None:
+        raise ValueError(f"{hex(offset)} 处设备树头异常")
+    return f"FDT v{comp.info['version']} {comp.length} 字节"
+
+
+def check_ramdisk(data, offset=FLASH_RAMDISK):
+    mv = memoryview(data)
+    if mv[offset:offset + 4] != MAGIC_UIMAGE:
+        # 裸 ramdisk 没有头可校验，只提示
+        return "不是 uImage，跳过 CRC 校验"
+    return check_uimage(mv, offset)
+
+
+def validate_boot_image(data, kernel=FLASH_KERNEL, ramdisk=FLASH_RAMDISK, dtb=FLASH_DTB):
+    """按 bootcmd 的布局检查一遍镜像，打印结果，全部通过返回 True"""
+    with instrument.stage('validate'):
+        return _validate_boot_image(data, kernel, ramdisk, dtb)
+
+
+def _validate_boot_image(data, kernel, ramdisk, dtb):
+    ok = True
+    for name, check, offset in (('内核', check_kernel, kernel),
+                                ('DTB', check_fdt, dtb),
+                                ('Ramdisk', check_ramdisk, ramdisk)):
+        try:
+            print(f"  [校验] {name} @ {hex(offset)}: {check(data, offset)}")
+        except ValueError as e:
+            print(f"  [校验失败] {name} @ {hex(offset)}: {e}")
+            ok = False
+    return ok
+
+
+if __name__ == "__main__":
+    failed = False
+    for filename in sys.argv[1:] or ['hybrid_v8_final.bin']:
+        print(f">>> {filename}")
+        with FlashImage.open(filename) as image:
+            failed |= not validate_boot_image(image.buf)
+    sys.exit(1 if failed else 0)
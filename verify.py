@@ -1,4 +1,121 @@
 import os
+import sys
+import json
+import hashlib
+import argparse
+import threading
+import instrument
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from image_io import FlashImage
+from layout import load_layout, build_plan, boot_offsets, parse_int
+
+MANIFEST_CHUNK = 0x40000  # 256KB
+MANIFEST_HASH = 'sha256'
+
+
+def _hash_chunk(buf, algorithm):
+    # hashlib 对大块数据会释放 GIL，多线程可以真正并行
+    return hashlib.new(algorithm, buf).hexdigest()
+
+
+def layout_regions(layout, source_paths=None):
+    """按布局描述和它的源镜像编译写入计划，切成覆盖整个镜像的分区表 [(名字, 起始, 结束)]。
+
+    每个区域延伸到下一个区域的起点 (中间的填充算前一个区域)；boot 段的位置和
+    vendor 落在某个区域中间时 (比如 hybrid 的内核整段复制到末尾) 也在那里切开。
+    """
+    paths = dict(layout['sources'], **(source_paths or {}))
+    sources = {name: FlashImage.open(path) for name, path in paths.items()}
+    try:
+        plan = build_plan(layout, sources)
+    finally:
+        for src in sources.values():
+            src.close()
+    cuts = {0: '(gap)'}
+    for step in sorted(plan['regions'].values(), key=lambda s: s.offset):
+        if step.length > 0:
+            cuts[step.offset] = step.name
+    marks = dict(zip(('kernel', 'ramdisk', 'dtb'), boot_offsets(layout, plan)))
+    if 'vendor' in layout:
+        marks['vendor'] = parse_int(layout['vendor'])
+    for name, offset in marks.items():
+        cuts.setdefault(offset, name)
+    starts = sorted(cuts)
+    return [(cuts[s], s, e) for s, e in zip(starts, starts[1:] + [plan['size']])]
+
+
+def make_manifest(image_file, layout='mixed', chunk_size=MANIFEST_CHUNK, algorithm=MANIFEST_HASH,
+                  source_paths=None):
+    """从一个确认可用的镜像生成分区/分块摘要清单；分区按 layout 和它的源镜像得出"""
+    desc = load_layout(layout)
+    table = layout_regions(desc, source_paths)
+    regions = []
+    with FlashImage.open(image_file) as image, ThreadPoolExecutor() as pool:
+        for name, start, end in table:
+            offsets = range(start, end, chunk_size)
+            chunks = list(pool.map(
+                lambda off: _hash_chunk(image.buf[off:min(off + chunk_size, end)], algorithm), offsets))
+            regions.append({'name': name, 'offset': start, 'length': end - start, 'chunks': chunks})
+        size = image.size
+    return {'layout': desc['name'], 'size': size, 'chunk_size': chunk_size,
+            'algorithm': algorithm, 'regions': regions}
+
+
+def verify_manifest(image_file, manifest, skip=(), pool=None):
+    """按清单分块并行校验，发现第一个不一致就停止。返回 (是否通过, 说明)"""
+    size = os.path.getsize(image_file)
+    if size != manifest['size']:
+        return False, f"文件大小 {size}，应为 {manifest['size']}"
+    chunk_size = manifest['chunk_size']
+    algorithm = manifest['algorithm']
+    jobs = []
+    for region in manifest['regions']:
+        if region['name'] in skip:
+            continue
+        end = region['offset'] + region['length']
+        for i, digest in enumerate(region['chunks']):
+            off = region['offset'] + i * chunk_size
+            jobs.append((region['name'], off, min(off + chunk_size, end), digest))
+
+    with instrument.stage('verify'):
+        return _verify_chunks(image_file, jobs, algorithm, pool)
+
+
+def _verify_chunks(image_file, jobs, algorithm, pool):
+    own_pool = pool is None
+    pool = pool or ThreadPoolExecutor()
+    mismatch = threading.Event()
+    failures = []
+
+    def check(job):
+        name, off, end, digest = job
+        if mismatch.is_set():
+            return
+        if _hash_chunk(image.buf[off:end], algorithm) != digest:
+            failures.append((off, name))
+            mismatch.set()
+
+    try:
+        with FlashImage.open(image_file) as image:
+            futures = [pool.submit(check, job) for job in jobs]
+            for future in as_completed(futures):
+                future.result()
+                if mismatch.is_set():
+                    for f in futures:
+                        f.cancel()
+                    break
+            # 等已经在跑的任务结束再关闭映射
+            for f in futures:
+                if not f.cancelled():
+                    f.result()
+    finally:
+        if own_pool:
+            pool.shutdown()
+    if failures:
+        off, name = min(failures)
+        return False, f"区域 {name} 在 {hex(off)} 处的数据块不一致"
+    return True, f"{len(jobs)} 个数据块全部一致"
+
 
 def check_firmware_health():
     print(">>> 开始对 mixed.bin 进行安全体检...\n")
@@ -53,4 +170,37 @@ def check_firmware_health():
     print("\n🎉 结论: 固件健康，可以放心刷入！")
 
 if __name__ == "__main__":
-    check_firmware_health()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('images', nargs='*', help='要校验的镜像 (配合 --manifest)')
+    parser.add_argument('--manifest', help='按摘要清单校验，不再需要 old.bin')
+    parser.add_argument('--make-manifest', metavar='GOOD_IMAGE', help='从确认可用的镜像生成清单')
+    parser.add_argument('--layout', default='mixed', help='生成清单用的布局 (layouts/ 下的名字或 JSON 路径)')
+    parser.add_argument('--source', action='append', default=[], metavar='NAME=PATH',
+                        help='覆盖布局里的源镜像路径 (生成清单时要用源镜像定出各区域)')
+    parser.add_argument('--skip', default='', help='跳过这些区域，逗号分隔 (如 env,vendor)')
+    parser.add_argument('-o', '--output', default='manifest.json')
+    args = parser.parse_args()
+
+    if args.make_manifest:
+        source_paths = dict(item.partition('=')[::2] for item in args.source)
+        try:
+            manifest = make_manifest(args.make_manifest, args.layout, source_paths=source_paths)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        with open(args.output, 'w') as f:
+            json.dump(manifest, f, indent=1)
+        print(f"✅ 清单已生成: {args.output} ({args.layout} 布局)")
+    elif args.manifest:
+        with open(args.manifest) as f:
+            manifest = json.load(f)
+        skip = set(filter(None, args.skip.split(',')))
+        failed = 0
+        with ThreadPoolExecutor() as pool:
+            for image_file in args.images or ['mixed.bin']:
+                ok, msg = verify_manifest(image_file, manifest, skip, pool)
+                print(f"{'✅ [通过]' if ok else '❌ [失败]'} {image_file}: {msg}")
+                failed += not ok
+        sys.exit(1 if failed else 0)
+    else:
+        check_firmware_health()